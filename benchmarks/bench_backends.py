@@ -0,0 +1,108 @@
+import argparse
+import json
+import os
+import sys
+import time
+from collections import Counter
+from typing import Dict, List
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from src.geolocation_extraction import GeolocationExtractor
+
+_DEFAULT_TEXTS = [
+    "Heavy rains flooded several villages near Nabeul and Hammamet on Sunday.",
+    "Des frappes ont touché Gaza et Rafah dans la nuit.",
+    "Die Stadt Charkiw wurde erneut beschossen.",
+    "Las inundaciones afectaron a Valencia y Alicante.",
+    "Aid convoys reached Aleppo after leaving Damascus.",
+    "I am nowhere in particular today.",
+]
+
+_DEFAULT_LOCATION_NAMES = [
+    "Tunisie", "Charkiw", "Alemania", "Londres", "Beyrouth", "Damas", "Le Caire", "Genève",
+]
+
+
+def _entities_parity(
+    reference: List[List[Dict[str, str]]], candidate: List[List[Dict[str, str]]]
+) -> Dict[str, float]:
+    """
+    Entity-level precision / recall / F1 of `candidate` against `reference`,
+    comparing the multiset of extracted location names of every document.
+    """
+    n_true_positives, n_reference, n_candidate = 0, 0, 0
+    for reference_locations, candidate_locations in zip(reference, candidate):
+        reference_names = Counter(loc["original"] for loc in reference_locations)
+        candidate_names = Counter(loc["original"] for loc in candidate_locations)
+        n_true_positives += sum((reference_names & candidate_names).values())
+        n_reference += sum(reference_names.values())
+        n_candidate += sum(candidate_names.values())
+
+    precision = n_true_positives / n_candidate if n_candidate > 0 else 1.0
+    recall = n_true_positives / n_reference if n_reference > 0 else 1.0
+    f1 = (
+        2 * precision * recall / (precision + recall) if precision + recall > 0 else 0.0
+    )
+    return {"precision": precision, "recall": recall, "f1": f1}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Throughput and parity of the inference backends against torch."
+    )
+    parser.add_argument("--ner_model", default=os.getenv(
+        "NER_MODEL_NAME", "dbmdz/bert-large-cased-finetuned-conll03-english"
+    ))
+    parser.add_argument("--mt_model", default=os.getenv(
+        "MT_TO_EN_MODEL_NAME", "Helsinki-NLP/opus-mt-mul-en"
+    ))
+    parser.add_argument("--backends", nargs="+", default=["torch", "torch-int8", "onnx"])
+    parser.add_argument("--texts_file", default=None, help="One text per line.")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--output", default=None, help="Write the report as JSON.")
+    args = parser.parse_args()
+
+    if args.texts_file is not None:
+        with open(args.texts_file, "r") as f:
+            texts = [line.strip() for line in f if line.strip()]
+    else:
+        texts = _DEFAULT_TEXTS
+    texts = texts * args.repeat
+    location_names = _DEFAULT_LOCATION_NAMES * args.repeat
+
+    report = {}
+    reference_entities, reference_translations = None, None
+    for backend in ["torch"] + [b for b in args.backends if b != "torch"]:
+        extractor = GeolocationExtractor(
+            model_name=args.ner_model,
+            mt_to_en_model=args.mt_model,
+            device="cpu",
+            backend=backend,
+            collect_garbage=False,
+        )
+
+        start = time.perf_counter()
+        entities = extractor.extract_locations(texts)
+        ner_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        translations = extractor._translate_loc_to_english(location_names)
+        mt_time = time.perf_counter() - start
+
+        if reference_entities is None:
+            reference_entities, reference_translations = entities, translations
+
+        report[backend] = {
+            "ner_docs_per_s": len(texts) / ner_time,
+            "mt_names_per_s": len(location_names) / mt_time,
+            "entities_parity": _entities_parity(reference_entities, entities),
+            "translations_agreement": sum(
+                a == b for a, b in zip(reference_translations, translations)
+            )
+            / len(translations),
+        }
+        print(backend, json.dumps(report[backend]))
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=4)
@@ -0,0 +1,93 @@
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from benchmarks.synthetic import _mutate_name, make_synthetic_gazetteer
+from src.gazetteer import _GeoNamesMatchIndex, _GlobalNamesIndex
+from src.metrics import ExtractionMetrics
+
+
+def _time_lookups(find, terms):
+    metrics = ExtractionMetrics()
+    start = time.perf_counter()
+    for term in terms:
+        find(term, metrics)
+    elapsed = time.perf_counter() - start
+    return {
+        "ms_per_term": elapsed / len(terms) * 1e3,
+        "fuzzy_comparisons_per_term": metrics.get("fuzzy_comparisons_total") / len(terms),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Cost of country-agnostic lookups in the global names index, "
+        "compared with the lookups of one country."
+    )
+    parser.add_argument("--n_countries", type=int, default=50)
+    parser.add_argument("--names_per_country", type=int, default=10_000)
+    parser.add_argument("--n_terms", type=int, default=500)
+    parser.add_argument(
+        "--merged_scan",
+        action="store_true",
+        help="Also time the match index of all the countries merged (slow).",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="Write the report as JSON.")
+    args = parser.parse_args()
+
+    feature_names_to_id = make_synthetic_gazetteer(
+        args.n_countries, args.names_per_country, seed=args.seed
+    )
+    country_names = list(feature_names_to_id["Country 0"].keys())
+
+    report = {}
+    start = time.perf_counter()
+    country_index = _GeoNamesMatchIndex(country_names)
+    report["country_index_build_s"] = time.perf_counter() - start
+    start = time.perf_counter()
+    global_index = _GlobalNamesIndex(feature_names_to_id)
+    report["global_index_build_s"] = time.perf_counter() - start
+    report["global_index_names"] = len(global_index)
+    report["global_index_shards"] = len(global_index.shards)
+
+    rng = random.Random(args.seed + 1)
+    all_names = list(global_index.names_entries.keys())
+    country_typos = [_mutate_name(rng.choice(country_names), rng) for _ in range(args.n_terms)]
+    global_typos = [_mutate_name(rng.choice(all_names), rng) for _ in range(args.n_terms)]
+    exact_names = [rng.choice(country_names) for _ in range(args.n_terms)]
+
+    # the pieces of the keys are indexed on the first lookups
+    for term in global_typos[:100]:
+        global_index.find_candidates([term])
+
+    report["exact_country"] = _time_lookups(
+        lambda term, metrics: country_index.find_matches([term], metrics=metrics), exact_names
+    )
+    report["exact_global"] = _time_lookups(
+        lambda term, metrics: global_index.find_candidates([term], metrics=metrics),
+        exact_names,
+    )
+    report["fuzzy_country"] = _time_lookups(
+        lambda term, metrics: country_index.find_matches([term], metrics=metrics),
+        country_typos,
+    )
+    report["fuzzy_global"] = _time_lookups(
+        lambda term, metrics: global_index.find_candidates([term], metrics=metrics),
+        global_typos,
+    )
+    if args.merged_scan:
+        merged_index = _GeoNamesMatchIndex(all_names)
+        report["fuzzy_merged"] = _time_lookups(
+            lambda term, metrics: merged_index.find_matches([term], metrics=metrics),
+            global_typos[:100],
+        )
+
+    print(json.dumps(report, indent=4))
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=4)
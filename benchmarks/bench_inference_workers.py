@@ -0,0 +1,91 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from benchmarks.synthetic import make_synthetic_corpus, make_synthetic_gazetteer
+from src.geolocation_extraction import GeolocationExtractor
+from src.inference_workers import _get_memory_usage
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="NER and translation throughput, and memory per worker, "
+        "for an increasing number of inference worker processes."
+    )
+    parser.add_argument("--ner_model", default=os.getenv(
+        "NER_MODEL_NAME", "dbmdz/bert-large-cased-finetuned-conll03-english"
+    ))
+    parser.add_argument("--mt_model", default=os.getenv(
+        "MT_TO_EN_MODEL_NAME", "Helsinki-NLP/opus-mt-mul-en"
+    ))
+    parser.add_argument("--texts_file", default=None, help="One text per line.")
+    parser.add_argument("--n_documents", type=int, default=500)
+    parser.add_argument("--max_workers", type=int, default=os.cpu_count())
+    parser.add_argument("--threads_per_worker", type=int, default=None)
+    parser.add_argument("--output", default=None, help="Write the report as JSON.")
+    args = parser.parse_args()
+
+    if args.texts_file is not None:
+        with open(args.texts_file, "r") as f:
+            texts = [line.strip() for line in f if line.strip()]
+    else:
+        texts = make_synthetic_corpus(make_synthetic_gazetteer(5, 2_000), args.n_documents)
+
+    report = {}
+    reference_entities, reference_translations = None, None
+    for n_workers in sorted({1, 2, 4, 8, 16, args.max_workers}):
+        if n_workers > args.max_workers:
+            continue
+        extractor = GeolocationExtractor(
+            model_name=args.ner_model,
+            mt_to_en_model=args.mt_model,
+            device="cpu",
+            collect_garbage=False,
+            show_progress_bars=False,
+            inference_workers=n_workers,
+            inference_threads_per_worker=args.threads_per_worker,
+        )
+        if extractor.inference_pool is not None:
+            # forking is a one-time cost, not part of the throughput
+            extractor.inference_pool.start()
+
+        start = time.perf_counter()
+        entities = extractor.extract_locations(texts)
+        ner_time = time.perf_counter() - start
+
+        location_names = sorted({loc["original"] for locs in entities for loc in locs})
+        start = time.perf_counter()
+        if extractor.inference_pool is not None:
+            translations = extractor.inference_pool.translate(
+                location_names, extractor.translation_batch_size
+            )
+        else:
+            translations = extractor._translate_loc_to_english(location_names)
+        mt_time = time.perf_counter() - start
+
+        if reference_entities is None:
+            reference_entities, reference_translations = entities, translations
+            reference_ner_time = ner_time
+
+        report[n_workers] = {
+            "ner_docs_per_s": len(texts) / ner_time,
+            "ner_speedup": reference_ner_time / ner_time,
+            "mt_names_per_s": len(location_names) / mt_time if location_names else None,
+            "identical_entities": entities == reference_entities,
+            "identical_translations": translations == reference_translations,
+            "parent_memory": _get_memory_usage(),
+            "workers_memory": (
+                extractor.inference_pool.get_memory_usage()
+                if extractor.inference_pool is not None
+                else []
+            ),
+        }
+        print(f"workers {n_workers:>3}:", json.dumps(report[n_workers]))
+        extractor.close()
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=4)
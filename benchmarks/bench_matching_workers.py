@@ -0,0 +1,48 @@
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from benchmarks.synthetic import _random_name, make_synthetic_gazetteer
+from src.gazetteer import _GeoNamesMatchIndex
+from src.get_polygons import _get_final_location_ids_parallel
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Matching throughput for an increasing number of worker processes."
+    )
+    parser.add_argument("--n_names", type=int, default=20_000)
+    parser.add_argument("--n_documents", type=int, default=2_000)
+    parser.add_argument("--locations_per_document", type=int, default=3)
+    parser.add_argument("--max_workers", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    feature_names_to_id = make_synthetic_gazetteer(1, args.n_names)["Country 0"]
+    match_index = _GeoNamesMatchIndex(list(feature_names_to_id.keys()))
+    # unseen names so that every location goes through the fuzzy matching
+    documents = [
+        [{"original": _random_name(rng)} for _ in range(args.locations_per_document)]
+        for _ in range(args.n_documents)
+    ]
+
+    reference_outputs = None
+    for n_workers in sorted({1, 2, 4, 8, 16, args.max_workers}):
+        if n_workers > args.max_workers:
+            continue
+        start = time.perf_counter()
+        outputs = _get_final_location_ids_parallel(
+            documents, feature_names_to_id, match_index, n_workers=n_workers
+        )
+        elapsed = time.perf_counter() - start
+
+        if reference_outputs is None:
+            reference_outputs = outputs
+        print(
+            f"workers {n_workers:>3}: {elapsed:.2f} s, "
+            f"{args.n_documents / elapsed:.0f} docs/s, "
+            f"identical outputs: {outputs == reference_outputs}"
+        )
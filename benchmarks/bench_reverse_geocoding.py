@@ -0,0 +1,98 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import shapely
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from src.reverse_geocoding import ReverseGeocoder, _save_polygons_index
+
+
+def make_synthetic_polygons(n_polygons: int, n_countries: int = 5, seed: int = 0):
+    """
+    Voronoi cells of random points over a 40x40 degrees area, each with a
+    3-level hierarchy; countries are vertical bands.
+    """
+    rng = np.random.default_rng(seed)
+    seeds = rng.uniform([0, 0], [40, 40], size=(n_polygons, 2))
+    cells = shapely.voronoi_polygons(shapely.multipoints(seeds), extend_to=shapely.box(0, 0, 40, 40))
+    geometries = shapely.intersection(shapely.get_parts(cells), shapely.box(0, 0, 40, 40))
+
+    countries, locations_hierarchies = [], []
+    for polygon_id, geometry in enumerate(geometries):
+        centroid = shapely.centroid(geometry)
+        country_id = min(int(centroid.x / 40 * n_countries), n_countries - 1)
+        region_id = f"{country_id}-{int(centroid.y // 5)}"
+        countries.append(f"Country {country_id}")
+        locations_hierarchies.append(
+            {
+                0: {"id": f"C{country_id}", "name": f"Country {country_id}", "Pcode": f"C{country_id}"},
+                1: {"id": f"R{region_id}", "name": f"Region {region_id}", "Pcode": f"R{region_id}"},
+                2: {"id": f"D{polygon_id}", "name": f"District {polygon_id}", "Pcode": f"D{polygon_id}"},
+            }
+        )
+    return geometries, countries, locations_hierarchies
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Batch point-in-polygon throughput of the reverse geocoding index."
+    )
+    parser.add_argument("--n_polygons", type=int, default=50_000)
+    parser.add_argument("--n_points", type=int, default=100_000)
+    parser.add_argument(
+        "--n_scan_points",
+        type=int,
+        default=200,
+        help="Points resolved by scanning all the polygons, for comparison.",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="Write the report as JSON.")
+    args = parser.parse_args()
+
+    geometries, countries, locations_hierarchies = make_synthetic_polygons(
+        args.n_polygons, seed=args.seed
+    )
+    index_path = os.path.join(tempfile.mkdtemp(prefix="geo_extract_bench_"), "index.pkl")
+
+    report = {"n_polygons": len(geometries)}
+    start = time.perf_counter()
+    _save_polygons_index(geometries, countries, locations_hierarchies, index_path)
+    report["index_build_s"] = time.perf_counter() - start
+    report["index_size_mb"] = os.path.getsize(index_path) / 1e6
+
+    reverse_geocoder = ReverseGeocoder(index_path)
+    start = time.perf_counter()
+    reverse_geocoder._get_polygons_index()
+    report["index_load_s"] = time.perf_counter() - start
+
+    rng = np.random.default_rng(args.seed + 1)
+    points = [tuple(point) for point in rng.uniform([-2, -2], [42, 42], size=(args.n_points, 2))]
+
+    start = time.perf_counter()
+    tree_results = reverse_geocoder.get_locations_hierarchies(points)
+    elapsed = time.perf_counter() - start
+    report["tree_points_per_s"] = len(points) / elapsed
+
+    # one containment test against every polygon per point
+    start = time.perf_counter()
+    scan_results = []
+    for latitude, longitude in points[: args.n_scan_points]:
+        polygons_ids = np.flatnonzero(
+            shapely.intersects(geometries, shapely.points(longitude, latitude))
+        )
+        scan_results.append(
+            locations_hierarchies[polygons_ids[0]] if len(polygons_ids) > 0 else {}
+        )
+    elapsed = time.perf_counter() - start
+    report["scan_points_per_s"] = args.n_scan_points / elapsed
+    report["identical_results"] = scan_results == tree_results[: args.n_scan_points]
+
+    print(json.dumps(report, indent=4))
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=4)
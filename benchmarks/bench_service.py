@@ -0,0 +1,136 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from benchmarks.synthetic import (
+    make_synthetic_corpus,
+    make_synthetic_gazetteer,
+    make_tiny_models,
+    save_gazetteer,
+)
+from src.gazetteer import Gazetteer
+from src.geolocation_extraction import GeolocationExtractor
+from src.service import GeolocationService
+
+
+async def _run_load(
+    service: GeolocationService,
+    requests: List[Dict[str, Any]],
+    concurrency: int,
+) -> Dict[str, float]:
+    """
+    `concurrency` clients send the requests back to back; returns latency
+    percentiles and throughput.
+    """
+    latencies = []
+    next_request = iter(requests)
+
+    async def _client():
+        for request in next_request:
+            start = time.perf_counter()
+            await service.extract(request["text"], request["countries"])
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[_client() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - start
+
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        "p50_ms": float(np.percentile(latencies_ms, 50)),
+        "p99_ms": float(np.percentile(latencies_ms, 99)),
+        "requests_per_s": len(requests) / elapsed,
+        "texts_per_s": sum(len(request["text"]) for request in requests) / elapsed,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Latency and throughput of GeolocationService under concurrent load."
+    )
+    parser.add_argument("--n_requests", type=int, default=500)
+    parser.add_argument("--texts_per_request", type=int, default=2)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--n_countries", type=int, default=3)
+    parser.add_argument("--names_per_country", type=int, default=5_000)
+    parser.add_argument("--max_batch_texts", type=int, default=64)
+    parser.add_argument("--max_wait_ms", type=float, default=10)
+    parser.add_argument(
+        "--ner_model", default=None, help="Defaults to a tiny locally built stand-in."
+    )
+    parser.add_argument(
+        "--mt_model", default=None, help="Defaults to a tiny locally built stand-in."
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--work_dir", default=None)
+    parser.add_argument("--output", default=None, help="Write the report as JSON.")
+    args = parser.parse_args()
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="geo_extract_bench_")
+    os.makedirs(work_dir, exist_ok=True)
+    feature_names_to_id = make_synthetic_gazetteer(
+        args.n_countries, args.names_per_country, seed=args.seed
+    )
+    gazetteer_path = os.path.join(work_dir, "feature_name_to_id.json")
+    save_gazetteer(feature_names_to_id, gazetteer_path)
+    documents = make_synthetic_corpus(
+        feature_names_to_id,
+        args.n_requests * args.texts_per_request,
+        long_documents_ratio=0,
+        seed=args.seed,
+    )
+
+    ner_model, mt_model = args.ner_model, args.mt_model
+    if ner_model is None or mt_model is None:
+        make_tiny_models(os.path.join(work_dir, "models"), feature_names_to_id, documents)
+        ner_model = ner_model or os.path.join(work_dir, "models", "ner")
+        mt_model = mt_model or os.path.join(work_dir, "models", "mt")
+
+    # every request targets one or two countries
+    rng = random.Random(args.seed)
+    countries = list(feature_names_to_id.keys())
+    requests = [
+        {
+            "text": documents[i : i + args.texts_per_request],
+            "countries": rng.sample(countries, rng.randint(1, min(2, len(countries)))),
+        }
+        for i in range(0, len(documents), args.texts_per_request)
+    ]
+
+    async def _main() -> Dict[str, Dict[str, float]]:
+        report = {}
+        # one request per batch is the same as calling the extractor per request
+        for name, max_batch_texts in [
+            ("per_request", 1),
+            ("micro_batching", args.max_batch_texts),
+        ]:
+            extractor = GeolocationExtractor(
+                model_name=ner_model,
+                mt_to_en_model=mt_model,
+                gazetteer=Gazetteer(gazetteer_path),
+                collect_garbage=False,
+                show_progress_bars=False,
+            )
+            async with GeolocationService(
+                extractor, max_batch_texts=max_batch_texts, max_wait_ms=args.max_wait_ms
+            ) as service:
+                # warm up the models, gazetteer and caches
+                await _run_load(service, requests[: args.concurrency], args.concurrency)
+                report[name] = await _run_load(service, requests, args.concurrency)
+                report[name]["batches"] = extractor.metrics.get("service_batches_total")
+            print(name, json.dumps(report[name]))
+        return report
+
+    report = asyncio.run(_main())
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=4)
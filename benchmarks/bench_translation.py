@@ -0,0 +1,131 @@
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from typing import List
+
+import torch
+from fuzzywuzzy import fuzz
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from src.geolocation_extraction import GeolocationExtractor
+
+# place names in several languages and scripts, as found by the NER
+_DEFAULT_LOCATION_NAMES = [
+    "Tunisie", "Allemagne", "Londres", "Beyrouth", "Damas", "Le Caire", "Genève",
+    "Nouvelle-Orléans", "Côte d'Ivoire", "Mer Méditerranée", "Charkiw", "Köln",
+    "München", "Wien", "Ostsee", "Alemania", "Nueva York", "Ciudad de México",
+    "Río de la Plata", "Sevilla", "Estados Unidos", "Moscou", "Pékin", "Varsovie",
+    "Harkov", "Jerusalén", "Saná", "Mogadiscio", "Bakou", "Kiev", "Harkiv",
+    "Москва", "Санкт-Петербург", "Харьков", "Киев", "Одесса", "Чёрное море",
+    "القاهرة", "دمشق", "بيروت", "غزة", "رفح", "حلب", "الخرطوم", "صنعاء",
+    "北京", "上海", "香港", "東京", "大阪", "서울", "부산", "Αθήνα", "Θεσσαλονίκη",
+    "תל אביב", "ירושלים", "Τουρκία", "İstanbul", "Ankara", "Şanlıurfa",
+]
+
+
+@torch.no_grad()
+def _translate_in_arrival_order(
+    extractor: GeolocationExtractor, text: List[str], batch_size: int = 8
+) -> List[str]:
+    """
+    The previous translation path: batches of 8 in arrival order, default decoding
+    of the model, and a `gc.collect()` after every batch.
+    """
+    import gc
+
+    translations = []
+    for i in range(0, len(text), batch_size):
+        encoded = extractor.mt_to_en_tokenizer(
+            text[i : i + batch_size], return_tensors="pt", padding=True
+        ).to(extractor.device)
+        translated = extractor.mt_to_en_model.generate(**encoded)
+        translations.extend(
+            extractor.mt_to_en_tokenizer.decode(t, skip_special_tokens=True)
+            for t in translated
+        )
+        gc.collect()
+    return translations
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Throughput and agreement of the name translation settings "
+        "against the previous translation path."
+    )
+    parser.add_argument("--ner_model", default=os.getenv(
+        "NER_MODEL_NAME", "dbmdz/bert-large-cased-finetuned-conll03-english"
+    ))
+    parser.add_argument("--mt_model", default=os.getenv(
+        "MT_TO_EN_MODEL_NAME", "Helsinki-NLP/opus-mt-mul-en"
+    ))
+    parser.add_argument("--names_file", default=None, help="One location name per line.")
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--batch_sizes", type=int, nargs="+", default=[32, 64])
+    parser.add_argument("--num_beams", type=int, nargs="+", default=[1, 2])
+    parser.add_argument("--max_length_ratio", type=float, default=2.0)
+    parser.add_argument("--output", default=None, help="Write the report as JSON.")
+    args = parser.parse_args()
+
+    if args.names_file is not None:
+        with open(args.names_file, "r") as f:
+            location_names = [line.strip() for line in f if line.strip()]
+    else:
+        location_names = _DEFAULT_LOCATION_NAMES
+    # arrival order of the names in a batch of documents
+    location_names = location_names * args.repeat
+    random.Random(0).shuffle(location_names)
+
+    extractor = GeolocationExtractor(
+        model_name=args.ner_model,
+        mt_to_en_model=args.mt_model,
+        device="cpu",
+        show_progress_bars=False,
+    )
+    # warm-up, not measured
+    _translate_in_arrival_order(extractor, location_names[:8])
+
+    start = time.perf_counter()
+    reference = _translate_in_arrival_order(extractor, location_names)
+    reference_time = time.perf_counter() - start
+    report = {"previous": {"names_per_s": len(location_names) / reference_time}}
+    print("previous", json.dumps(report["previous"]))
+
+    # (8, None, None) sorts the names by length but keeps the previous decoding
+    settings = [(8, None, None)] + [
+        (batch_size, num_beams, args.max_length_ratio)
+        for batch_size in args.batch_sizes
+        for num_beams in args.num_beams
+    ]
+    for batch_size, num_beams, max_length_ratio in settings:
+        extractor.translation_batch_size = batch_size
+        extractor.translation_num_beams = num_beams
+        extractor.translation_max_length_ratio = max_length_ratio
+
+        start = time.perf_counter()
+        translations = extractor._translate_loc_to_english(location_names)
+        elapsed = time.perf_counter() - start
+
+        name = (
+            f"batch_size={batch_size},num_beams={num_beams},"
+            f"max_length_ratio={max_length_ratio}"
+        )
+        report[name] = {
+            "names_per_s": len(location_names) / elapsed,
+            "speedup": reference_time / elapsed,
+            "identical_translations": sum(
+                a == b for a, b in zip(reference, translations)
+            )
+            / len(translations),
+            "mean_similarity": sum(
+                fuzz.ratio(a, b) for a, b in zip(reference, translations)
+            )
+            / len(translations),
+        }
+        print(name, json.dumps(report[name]))
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=4)
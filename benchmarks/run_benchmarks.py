@@ -0,0 +1,170 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from typing import Any, Dict
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from benchmarks.synthetic import (
+    make_synthetic_corpus,
+    make_synthetic_gazetteer,
+    make_tiny_models,
+    save_gazetteer,
+)
+from src.gazetteer import Gazetteer
+from src.geolocation_extraction import GeolocationExtractor, _get_outputs
+from src.get_polygons import _find_matches
+
+
+def _stage_result(elapsed: float, n_items: int, items_name: str) -> Dict[str, Any]:
+    return {
+        "seconds": elapsed,
+        items_name: n_items,
+        f"{items_name}_per_s": n_items / elapsed if elapsed > 0 else None,
+    }
+
+
+def run_benchmarks(args: argparse.Namespace) -> Dict[str, Any]:
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="geo_extract_bench_")
+    os.makedirs(work_dir, exist_ok=True)
+
+    feature_names_to_id = make_synthetic_gazetteer(
+        args.n_countries, args.names_per_country, seed=args.seed
+    )
+    gazetteer_path = os.path.join(work_dir, "feature_name_to_id.json")
+    save_gazetteer(feature_names_to_id, gazetteer_path)
+    documents = make_synthetic_corpus(
+        feature_names_to_id,
+        args.n_documents,
+        long_documents_ratio=args.long_documents_ratio,
+        seed=args.seed,
+    )
+    countries = list(feature_names_to_id.keys())
+
+    ner_model, mt_model = args.ner_model, args.mt_model
+    if ner_model is None or mt_model is None:
+        make_tiny_models(os.path.join(work_dir, "models"), feature_names_to_id, documents)
+        ner_model = ner_model or os.path.join(work_dir, "models", "ner")
+        mt_model = mt_model or os.path.join(work_dir, "models", "mt")
+
+    stages = {}
+
+    start = time.perf_counter()
+    gazetteer = Gazetteer(gazetteer_path)
+    country_feature_names_to_id, match_index = gazetteer.get_feature_names_to_id(countries)
+    hierarchy = gazetteer.get_admin_hierarchy(countries)
+    stages["gazetteer_load"] = _stage_result(
+        time.perf_counter() - start, len(country_feature_names_to_id), "names"
+    )
+
+    extractor = GeolocationExtractor(
+        model_name=ner_model,
+        mt_to_en_model=mt_model,
+        gazetteer=gazetteer,
+        backend=args.backend,
+        collect_garbage=False,
+    )
+
+    start = time.perf_counter()
+    ner_results = extractor.extract_locations(documents)
+    stages["ner"] = _stage_result(time.perf_counter() - start, len(documents), "documents")
+
+    unique_locations = list(
+        dict.fromkeys(loc["original"] for locs in ner_results for loc in locs)
+    )
+    start = time.perf_counter()
+    to_be_translated = extractor._get_locations_to_translate(unique_locations, countries)
+    stages["language_detection"] = _stage_result(
+        time.perf_counter() - start, len(unique_locations), "strings"
+    )
+
+    start = time.perf_counter()
+    translations = dict(
+        zip(to_be_translated, extractor._translate_loc_to_english(to_be_translated))
+    )
+    stages["translation"] = _stage_result(
+        time.perf_counter() - start, len(to_be_translated), "strings"
+    )
+    for locs in ner_results:
+        for loc in locs:
+            loc["translated_to_en"] = translations.get(loc["original"], loc["original"])
+
+    start = time.perf_counter()
+    matched_names = [
+        [
+            _find_matches(
+                list(dict.fromkeys(loc.values())),
+                match_index.geo_names,
+                match_index=match_index,
+            )
+            for loc in locs
+        ]
+        for locs in ner_results
+    ]
+    n_mentions = sum(len(locs) for locs in ner_results)
+    stages["fuzzy_matching"] = _stage_result(
+        time.perf_counter() - start, n_mentions, "mentions"
+    )
+
+    start = time.perf_counter()
+    matched_locations = [
+        {
+            loc["original"]: hierarchy.get_location_hierarchy(names[0])
+            if len(names) > 0
+            else {}
+            for loc, names in zip(locs, doc_matched_names)
+        }
+        for locs, doc_matched_names in zip(ner_results, matched_names)
+    ]
+    _get_outputs(ner_results, matched_locations)
+    stages["admin_level_aggregation"] = _stage_result(
+        time.perf_counter() - start, n_mentions, "mentions"
+    )
+
+    start = time.perf_counter()
+    extractor(documents, countries)
+    stages["end_to_end"] = _stage_result(
+        time.perf_counter() - start, len(documents), "documents"
+    )
+
+    return {
+        "config": {
+            key: value for key, value in vars(args).items() if key not in ["output"]
+        },
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "stages": stages,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Per-stage benchmark on a synthetic gazetteer and multilingual corpus."
+    )
+    parser.add_argument("--n_countries", type=int, default=3)
+    parser.add_argument("--names_per_country", type=int, default=10_000)
+    parser.add_argument("--n_documents", type=int, default=500)
+    parser.add_argument("--long_documents_ratio", type=float, default=0.1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--ner_model", default=None, help="Defaults to a tiny locally built stand-in."
+    )
+    parser.add_argument(
+        "--mt_model", default=None, help="Defaults to a tiny locally built stand-in."
+    )
+    parser.add_argument("--backend", default="torch")
+    parser.add_argument("--work_dir", default=None)
+    parser.add_argument("--output", default=None, help="Write the results as JSON.")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args)
+    print(json.dumps(results, indent=4))
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=4)
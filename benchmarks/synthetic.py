@@ -0,0 +1,265 @@
+import json
+import os
+import random
+import shutil
+from typing import Any, Dict, List
+
+_SYLLABLES = [
+    "ka", "ra", "bel", "na", "ul", "sha", "mi", "tor", "ven", "al",
+    "ou", "dz", "ia", "an", "kiv", "ham", "met", "sfa", "ba", "dor",
+]
+
+# a few sentence templates per language, `{}` is replaced by a location name
+_TEMPLATES = {
+    "en": ["Heavy rains flooded {} on Sunday.", "Aid convoys reached {} after two days.", "Clashes were reported near {} and {}."],
+    "fr": ["Des inondations ont touché {} dimanche.", "Les convois sont arrivés à {} après deux jours."],
+    "es": ["Las inundaciones afectaron a {} el domingo.", "Los convoyes llegaron a {} y {}."],
+    "de": ["Starke Regenfälle überschwemmten {} am Sonntag.", "Hilfskonvois erreichten {}."],
+    "ru": ["Сильные дожди затопили {} в воскресенье.", "Гуманитарные конвои достигли {}."],
+    "ar": ["غمرت الأمطار الغزيرة {} يوم الأحد.", "وصلت قوافل المساعدات إلى {}."],
+}
+
+_FILLER_WORDS = "the report said that local authorities were assessing damage and needs".split()
+
+
+def _random_name(rng: random.Random) -> str:
+    return " ".join(
+        "".join(rng.choice(_SYLLABLES) for _ in range(rng.randint(1, 4))).capitalize()
+        for _ in range(rng.randint(1, 2))
+    )
+
+
+def _mutate_name(name: str, rng: random.Random) -> str:
+    """
+    Small typo (insertion / deletion / substitution), to exercise the fuzzy matching.
+    """
+    position = rng.randrange(1, len(name))
+    operation = rng.choice(["insert", "delete", "substitute"])
+    if operation == "insert":
+        return name[:position] + rng.choice("aeiou") + name[position:]
+    if operation == "delete":
+        return name[:position] + name[position + 1 :]
+    return name[:position] + rng.choice("aeiou") + name[position + 1 :]
+
+
+def make_synthetic_gazetteer(
+    n_countries: int = 5, names_per_country: int = 10_000, seed: int = 0
+) -> Dict[str, Dict[str, Dict[str, Any]]]:
+    """
+    Gazetteer in the `feature_name_to_id.json` schema, with admin levels 0 to 4:
+    every name of level n has parents of levels 0..n-1 that exist in the gazetteer.
+    """
+    rng = random.Random(seed)
+    feature_names_to_id = {}
+    for country_id in range(n_countries):
+        country_name = f"Country {country_id}"
+        country_data = {
+            country_name: {
+                "id": f"C{country_id}",
+                "Pcode": f"C{country_id}",
+                "admin_level": 0,
+                "parent_locations": {},
+            }
+        }
+        names_by_level = {0: [country_name]}
+        while len(country_data) < names_per_country:
+            admin_level = rng.randint(1, 4)
+            if len(names_by_level.get(admin_level - 1, [])) == 0:
+                admin_level = 1
+            name = _random_name(rng)
+            if name in country_data:
+                continue
+
+            parent_name = rng.choice(names_by_level[admin_level - 1])
+            parent_locations = dict(country_data[parent_name]["parent_locations"])
+            parent_locations[f"parent {admin_level - 1}"] = {
+                "name": parent_name,
+                "id": country_data[parent_name]["id"],
+            }
+            country_data[name] = {
+                "id": f"C{country_id}-{len(country_data)}",
+                "Pcode": f"P{country_id}-{len(country_data)}",
+                "admin_level": admin_level,
+                "parent_locations": parent_locations,
+            }
+            names_by_level.setdefault(admin_level, []).append(name)
+
+        feature_names_to_id[country_name] = country_data
+    return feature_names_to_id
+
+
+def make_synthetic_corpus(
+    feature_names_to_id: Dict[str, Dict[str, Dict[str, Any]]],
+    n_documents: int = 1_000,
+    languages: List[str] = list(_TEMPLATES.keys()),
+    long_documents_ratio: float = 0.1,
+    seed: int = 0,
+) -> List[str]:
+    """
+    Multilingual documents mentioning gazetteer names (exact, with typos, or unknown).
+    A share of the documents are long articles, to mix short and long texts.
+    """
+    rng = random.Random(seed)
+    gazetteer_names = [
+        name for country_data in feature_names_to_id.values() for name in country_data
+    ]
+
+    def _mention() -> str:
+        draw = rng.random()
+        if draw < 0.6:
+            return rng.choice(gazetteer_names)
+        if draw < 0.85:
+            return _mutate_name(rng.choice(gazetteer_names), rng)
+        return _random_name(rng)
+
+    documents = []
+    for _ in range(n_documents):
+        template = rng.choice(_TEMPLATES[rng.choice(languages)])
+        sentence = template.format(*[_mention() for _ in range(template.count("{}"))])
+        if rng.random() < long_documents_ratio:
+            filler = " ".join(rng.choice(_FILLER_WORDS) for _ in range(rng.randint(200, 600)))
+            sentence = f"{sentence} {filler} {template.format(*[_mention() for _ in range(template.count('{}'))])}"
+        documents.append(sentence)
+    return documents
+
+
+def save_gazetteer(
+    feature_names_to_id: Dict[str, Dict[str, Dict[str, Any]]], file_path: os.PathLike
+):
+    with open(file_path, "w") as f:
+        json.dump(feature_names_to_id, f)
+
+
+def make_tiny_models(
+    output_dir: os.PathLike,
+    feature_names_to_id: Dict[str, Dict[str, Dict[str, Any]]],
+    documents: List[str],
+    seed: int = 0,
+):
+    """
+    Build small, randomly initialized stand-ins of the NER (BERT) and MT (Marian)
+    models in `output_dir`/ner and `output_dir`/mt.
+
+    The NER model has no attention layer: the tokens of gazetteer words are
+    embedded so that they are tagged LOC, which makes it find the mentioned
+    locations like a real model would. Timings are only meaningful relative to
+    each other; use the real models for absolute numbers.
+    """
+    import sentencepiece as spm
+    import torch
+    from transformers import (
+        BertConfig,
+        BertForTokenClassification,
+        BertTokenizerFast,
+        MarianConfig,
+        MarianMTModel,
+        MarianTokenizer,
+    )
+
+    torch.manual_seed(seed)
+    ner_dir = os.path.join(output_dir, "ner")
+    mt_dir = os.path.join(output_dir, "mt")
+    os.makedirs(ner_dir, exist_ok=True)
+    os.makedirs(mt_dir, exist_ok=True)
+
+    location_words = {
+        word
+        for country_data in feature_names_to_id.values()
+        for name in country_data
+        for word in name.split(" ")
+    }
+    corpus_words = {word.strip(".,") for document in documents for word in document.split()}
+    characters = sorted({c for word in corpus_words | location_words for c in word})
+    vocab = (
+        ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"]
+        + sorted(corpus_words | location_words)
+        + characters
+        + [f"##{c}" for c in characters]
+        + [".", ","]
+    )
+    vocab = list(dict.fromkeys(vocab))
+    vocab_ids = {token: i for i, token in enumerate(vocab)}
+    with open(os.path.join(ner_dir, "vocab.txt"), "w") as f:
+        f.write("\n".join(vocab))
+
+    labels = ["O", "B-LOC", "I-LOC"]
+    ner_config = BertConfig(
+        vocab_size=len(vocab),
+        hidden_size=32,
+        num_hidden_layers=0,
+        num_attention_heads=2,
+        intermediate_size=64,
+        max_position_embeddings=512,
+        num_labels=len(labels),
+        id2label=dict(enumerate(labels)),
+        label2id={label: i for i, label in enumerate(labels)},
+    )
+    ner_model = BertForTokenClassification(ner_config)
+    with torch.no_grad():
+        embeddings = ner_model.bert.embeddings
+        embeddings.position_embeddings.weight.zero_()
+        embeddings.token_type_embeddings.weight.zero_()
+        embeddings.word_embeddings.weight.normal_(0, 0.01)
+        embeddings.word_embeddings.weight[:, 0] = -1.0
+        for word in location_words:
+            embeddings.word_embeddings.weight[vocab_ids[word], 0] = 1.0
+        ner_model.classifier.weight.zero_()
+        ner_model.classifier.bias.zero_()
+        ner_model.classifier.weight[0, 0] = -5.0
+        ner_model.classifier.weight[1, 0] = 5.0
+
+    tokenizer = BertTokenizerFast(
+        vocab_file=os.path.join(ner_dir, "vocab.txt"), do_lower_case=False
+    )
+    tokenizer.model_max_length = 512
+    tokenizer.save_pretrained(ner_dir)
+    ner_model.save_pretrained(ner_dir)
+
+    corpus_path = os.path.join(mt_dir, "corpus.txt")
+    with open(corpus_path, "w") as f:
+        f.write("\n".join(documents + sorted(location_words)))
+    spm.SentencePieceTrainer.train(
+        input=corpus_path,
+        model_prefix=os.path.join(mt_dir, "source"),
+        vocab_size=256,
+        hard_vocab_limit=False,
+        character_coverage=1.0,
+        pad_id=-1,
+        bos_id=-1,
+        eos_id=1,
+        unk_id=0,
+    )
+    shutil.move(os.path.join(mt_dir, "source.model"), os.path.join(mt_dir, "source.spm"))
+    shutil.copy(os.path.join(mt_dir, "source.spm"), os.path.join(mt_dir, "target.spm"))
+
+    sentence_piece = spm.SentencePieceProcessor(model_file=os.path.join(mt_dir, "source.spm"))
+    mt_vocab = {
+        sentence_piece.id_to_piece(i): i for i in range(sentence_piece.get_piece_size())
+    }
+    mt_vocab["<pad>"] = len(mt_vocab)
+    with open(os.path.join(mt_dir, "vocab.json"), "w") as f:
+        json.dump(mt_vocab, f)
+
+    mt_tokenizer = MarianTokenizer(
+        source_spm=os.path.join(mt_dir, "source.spm"),
+        target_spm=os.path.join(mt_dir, "target.spm"),
+        vocab=os.path.join(mt_dir, "vocab.json"),
+    )
+    mt_config = MarianConfig(
+        vocab_size=len(mt_vocab),
+        d_model=32,
+        encoder_layers=2,
+        decoder_layers=2,
+        encoder_attention_heads=2,
+        decoder_attention_heads=2,
+        encoder_ffn_dim=64,
+        decoder_ffn_dim=64,
+        pad_token_id=mt_vocab["<pad>"],
+        eos_token_id=1,
+        decoder_start_token_id=mt_vocab["<pad>"],
+        max_length=32,
+        num_beams=4,
+    )
+    mt_tokenizer.save_pretrained(mt_dir)
+    MarianMTModel(mt_config).save_pretrained(mt_dir)
+    os.remove(corpus_path)
@@ -0,0 +1,93 @@
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from src.gazetteer import Gazetteer, _convert_json_to_db
+
+
+def _get_max_rss_mb() -> float:
+    # ru_maxrss survives exec on linux, VmHWM is reset with the new address space
+    if os.path.exists("/proc/self/status"):
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    # ru_maxrss is in kilobytes on linux and in bytes on macOS
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss / 1024**2 if sys.platform == "darwin" else max_rss / 1024
+
+
+def _measure_country_load(feature_names_to_id_path: os.PathLike, country_name: str):
+    """
+    Load one country from a gazetteer file and print the elapsed time and peak RSS.
+    Runs in its own process so that the RSS of one format does not leak into the other.
+    """
+    start = time.perf_counter()
+    gazetteer = Gazetteer(feature_names_to_id_path)
+    feature_names_to_id, _ = gazetteer.get_feature_names_to_id([country_name])
+    elapsed = time.perf_counter() - start
+
+    max_rss_mb = _get_max_rss_mb()
+    print(
+        json.dumps(
+            {
+                "load_time_s": elapsed,
+                "max_rss_mb": max_rss_mb,
+                "n_names": len(feature_names_to_id),
+            }
+        )
+    )
+
+
+def _compare_formats(json_path: os.PathLike, db_path: os.PathLike, country_name: str):
+    for feature_names_to_id_path in [json_path, db_path]:
+        result = subprocess.run(
+            [
+                sys.executable,
+                os.path.abspath(__file__),
+                "--measure",
+                feature_names_to_id_path,
+                country_name,
+            ],
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        measures = json.loads(result.stdout.strip().splitlines()[-1])
+        file_size_mb = os.path.getsize(feature_names_to_id_path) / 1024**2
+        print(
+            f"{feature_names_to_id_path}: size {file_size_mb:.1f} MB, "
+            f"load {measures['load_time_s']:.3f} s, "
+            f"max RSS {measures['max_rss_mb']:.1f} MB, "
+            f"{measures['n_names']} names for {country_name}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Convert feature_name_to_id.json to the compact SQLite gazetteer."
+    )
+    parser.add_argument("--json_path", default=os.path.join("..", "feature_name_to_id.json"))
+    parser.add_argument("--db_path", default=os.path.join("..", "feature_name_to_id.sqlite"))
+    parser.add_argument(
+        "--compare_country",
+        default=None,
+        help="Compare load time and RSS of both formats for this country.",
+    )
+    parser.add_argument("--measure", nargs=2, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure is not None:
+        _measure_country_load(*args.measure)
+        sys.exit(0)
+
+    if not os.path.exists(args.db_path):
+        _convert_json_to_db(args.json_path, args.db_path)
+
+    if args.compare_country is not None:
+        _compare_formats(args.json_path, args.db_path, args.compare_country)
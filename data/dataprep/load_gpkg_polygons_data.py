@@ -1,6 +1,9 @@
 from typing import List, Set, Optional, Dict
-import fiona
+import argparse
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
 import geopandas as gpd
+import numpy as np
 from shapely.geometry import mapping, shape
 import json
 from collections import defaultdict
@@ -8,81 +11,163 @@ from tqdm import tqdm
 from fuzzywuzzy import fuzz
 import pandas as pd
 import os
+import sys
 from copy import copy
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from src.gazetteer import (
+    Gazetteer,
+    _is_gazetteer_db,
+    _save_feature_names_to_id_db,
+    _convert_json_to_db,
+)
+from src.reverse_geocoding import _save_polygons_index
 
-def _create_filtered_features(file_path: os.PathLike, highest_polygon_id: int):
+
+_NAME_SUFFIXES = ["", "1", "2"]
+
+# bump when the output of `_create_country_features` changes, to force a full rebuild
+_BUILD_VERSION = 2
+
+
+def _get_attribute_columns(highest_polygon_id: int) -> List[str]:
+    return [
+        column
+        for level in range(0, highest_polygon_id + 1)
+        for column in [f"adm{level}_name{suffix}" for suffix in _NAME_SUFFIXES]
+        + [f"adm{level}_id", f"adm{level}_src"]
+    ]
+
+
+def _read_features_attributes(
+    file_path: os.PathLike, highest_polygon_id: int
+) -> pd.DataFrame:
+    """
+    Read the attribute columns of all the features in bulk, without the geometries.
+    Missing values are `None`, as when iterating the features with fiona.
+    """
+    columns = _get_attribute_columns(highest_polygon_id)
     if not os.path.exists(file_path):
+        return pd.DataFrame(columns=columns)
+
+    features = gpd.read_file(file_path, columns=columns, ignore_geometry=True)
+    features = features[columns].astype(object)
+    return features.where(features.notna(), None).reset_index(drop=True)
+
+
+def _get_country_checksum(country_features: pd.DataFrame) -> str:
+    # rows order matters: the last feature wins when names are duplicated
+    rows_hashes = pd.util.hash_pandas_object(
+        country_features.astype(str), index=False
+    ).to_numpy()
+    return hashlib.sha256(rows_hashes.tobytes()).hexdigest()
+
+
+def _create_country_features(
+    country_features: pd.DataFrame, highest_polygon_id: int
+) -> Dict[str, Dict]:
+    """
+    `{geo_name: {id, Pcode, admin_level, parent_locations}}` of the features of one country.
+
+    Every (feature, admin level, alternative name) gives one candidate entry. As in
+    a row by row pass, a name is placed at its first occurrence and takes the data
+    of its last one, so the parent locations are only built once per unique name.
+    """
+    columns = {column: country_features[column].tolist() for column in country_features}
+    n_levels, n_suffixes = highest_polygon_id + 1, len(_NAME_SUFFIXES)
+
+    candidates = []
+    for level in range(n_levels):
+        has_level = country_features[f"adm{level}_name"].notna().to_numpy()
+        for suffix_id, suffix in enumerate(_NAME_SUFFIXES):
+            names = country_features[f"adm{level}_name{suffix}"]
+            rows = np.flatnonzero(has_level & names.notna().to_numpy())
+            candidates.append(
+                pd.DataFrame(
+                    {
+                        "order": rows * n_levels * n_suffixes
+                        + level * n_suffixes
+                        + suffix_id,
+                        "row": rows,
+                        "level": level,
+                        "name": names.to_numpy()[rows],
+                    }
+                )
+            )
+    candidates = pd.concat(candidates, ignore_index=True).sort_values("order")
+
+    names_order = candidates.drop_duplicates("name", keep="first")["name"].tolist()
+    last_candidates = candidates.drop_duplicates("name", keep="last")
+
+    last_entries = {}
+    for geo_name, row, level in zip(
+        last_candidates["name"].tolist(),
+        last_candidates["row"].tolist(),
+        last_candidates["level"].tolist(),
+    ):
+        parent_locations = {}
+        for i in range(0, level):
+            for suffix in _NAME_SUFFIXES:
+                parent_name = columns[f"adm{i}_name{suffix}"][row]
+                if parent_name is not None:
+                    parent_locations[f"parent {i}"] = {
+                        "name": parent_name,
+                        "id": columns[f"adm{i}_id"][row],
+                        "Pcode": columns[f"adm{i}_src"][row],
+                    }
+
+        last_entries[geo_name] = {
+            "id": columns[f"adm{level}_id"][row],
+            "Pcode": columns[f"adm{level}_src"][row],
+            "admin_level": level,
+            "parent_locations": parent_locations,
+        }
+
+    return {geo_name: last_entries[geo_name] for geo_name in names_order}
+
+
+def _create_filtered_features(
+    features: pd.DataFrame,
+    highest_polygon_id: int,
+    country_names: List[str],
+    n_workers: int = 1,
+) -> Dict[str, Dict[str, Dict]]:
+    """
+    Build the `country_names` slices of `features`, one country per task,
+    the largest countries first.
+    """
+    country_names = set(country_names)
+    countries_features = {
+        country_name: country_features
+        for country_name, country_features in features.groupby("adm0_name", sort=False)
+        if country_name in country_names
+    }
+    country_names = sorted(
+        countries_features, key=lambda x: len(countries_features[x]), reverse=True
+    )
+    if len(country_names) == 0:
         return {}
-    feature_name_to_id = defaultdict(lambda: defaultdict(dict))
-
-    with fiona.open(
-        file_path, vfs="{}".format(file_path), enabled_drivers="GeoJSON"
-    ) as src:
-        with tqdm(
-            total=len(src),
-            desc=f"Processing features {file_path.split('/')[-1].replace('.gpkg', '')}",
-        ) as pbar:
-
-            for feature in src:
-                country_name = feature["properties"]["adm0_name"]
-                # Check if the feature satisfies the SQL filter condition for rows
-                # if country_name in countries:
-                # print(f"Processing {country_name}")
-                for child_level_id in range(0, highest_polygon_id + 1):
-
-                    child_level_name = f"adm{child_level_id}_name"
-                    # if child_level_id == 4:
-                    #     for property in feature["properties"]:
-                    #         if property.startswith("adm"):
-                    #             print(
-                    #                 "feature name:",
-                    #                 property,
-                    #                 ", ---feature value:",
-                    #                 feature["properties"][property],
-                    #             )
-
-                    if feature["properties"][child_level_name] is not None:
-
-                        parent_locations = {
-                            f"parent {i}": {
-                                "name": feature["properties"][f"adm{i}_name{name_id}"],
-                                "id": feature["properties"][f"adm{i}_id"],
-                            }
-                            for i in range(0, child_level_id)
-                            for name_id in ["", "1", 2]
-                            if feature["properties"][f"adm{i}_name{name_id}"]
-                            is not None
-                        }
-
-                        geo_id = feature["properties"][f"adm{child_level_id}_id"]
-                        geo_names = []
-                        for name_id in ["", 1, 2]:
-                            geo_one_name = feature["properties"][
-                                f"adm{child_level_id}_name{name_id}"
-                            ]
-                            if geo_one_name is not None:
-                                geo_names.append(geo_one_name)
-
-                        feature_pcode = feature["properties"][
-                            f"adm{child_level_id}_src"
-                        ]
-
-                        for geo_name in geo_names:
-                            feature_name_to_id[country_name][geo_name]["id"] = geo_id
-                            feature_name_to_id[country_name][geo_name][
-                                "Pcode"
-                            ] = feature_pcode
-                            feature_name_to_id[country_name][geo_name][
-                                "admin_level"
-                            ] = child_level_id
-                            # if len(parent_locations) > 0:
-                            feature_name_to_id[country_name][geo_name][
-                                "parent_locations"
-                            ] = parent_locations
-
-                pbar.update(1)
-    return feature_name_to_id
+
+    if n_workers <= 1 or len(country_names) == 1:
+        countries_data = [
+            _create_country_features(countries_features[country_name], highest_polygon_id)
+            for country_name in tqdm(country_names, desc="Processing countries")
+        ]
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            countries_data = list(
+                tqdm(
+                    executor.map(
+                        _create_country_features,
+                        [countries_features[country_name] for country_name in country_names],
+                        [highest_polygon_id] * len(country_names),
+                    ),
+                    total=len(country_names),
+                    desc="Processing countries",
+                )
+            )
+
+    return dict(zip(country_names, countries_data))
 
 
 def _merge_feature_name_to_id_data(
@@ -93,55 +178,211 @@ def _merge_feature_name_to_id_data(
     return final_feature_name_to_id
 
 
+def _get_checksums_path(feature_name_to_id_file_path: os.PathLike) -> str:
+    return f"{feature_name_to_id_file_path}.checksums.json"
+
+
+def _load_previous_checksums(
+    feature_name_to_id_file_path: os.PathLike, highest_polygon_id: int
+) -> Dict[str, Dict[str, str]]:
+    checksums_path = _get_checksums_path(feature_name_to_id_file_path)
+    if not os.path.exists(feature_name_to_id_file_path) or not os.path.exists(
+        checksums_path
+    ):
+        return {}
+
+    with open(checksums_path, "r") as f:
+        previous_build = json.load(f)
+    if (
+        previous_build.get("build_version") != _BUILD_VERSION
+        or previous_build.get("highest_polygon_id") != highest_polygon_id
+    ):
+        return {}
+    return previous_build["countries"]
+
+
 def _prepare_gpkg_data(
     relevant_name_part: str,
-    feature_name_to_id_file_path: os.PathLike
-):  # Not mentioning 'geometry' in imported_columns
+    feature_name_to_id_file_path: os.PathLike,
+    n_workers: int = os.cpu_count(),
+    force_rebuild: bool = False,
+) -> List[str]:  # Not mentioning 'geometry' in imported_columns
     """
     This function loads the polygons from the GeoPackage file and returns a GeoJSON object.
+    If `feature_name_to_id_file_path` ends with `.sqlite` / `.db`, the compact
+    integer-coded gazetteer database is written instead of the JSON file.
+
+    The build is incremental: the checksum of the source rows of every country is
+    saved next to the output (`<output>.checksums.json`), and only the countries whose
+    rows changed since the last build are rebuilt, in `n_workers` processes.
+    Returns the names of the rebuilt and removed countries: the output was rewritten
+    if it is not empty.
     """
 
     highest_polygon_id = int(relevant_name_part[-1])
 
-    polygons_data_path = f"{relevant_name_part}_polygons.gpkg"
-    polygons_feature_name_to_id = _create_filtered_features(
-        polygons_data_path, highest_polygon_id=highest_polygon_id
-    )
+    sources_features = {
+        source: _read_features_attributes(
+            f"{relevant_name_part}_{source}.gpkg", highest_polygon_id=highest_polygon_id
+        )
+        for source in ["polygons", "points"]
+    }
 
-    points_data_path = f"{relevant_name_part}_points.gpkg"
+    checksums = defaultdict(dict)
+    for source, features in sources_features.items():
+        for country_name, country_features in features.groupby("adm0_name", sort=False):
+            checksums[country_name][source] = _get_country_checksum(country_features)
 
-    points_feature_name_to_id = _create_filtered_features(
-        points_data_path, highest_polygon_id=highest_polygon_id
+    previous_checksums = (
+        {}
+        if force_rebuild
+        else _load_previous_checksums(feature_name_to_id_file_path, highest_polygon_id)
     )
+    changed_countries = [
+        country_name
+        for country_name in checksums
+        if previous_checksums.get(country_name) != checksums[country_name]
+    ]
+    removed_countries = set(previous_checksums) - set(checksums)
+    print(
+        f"{len(changed_countries)} countries to build, "
+        f"{len(checksums) - len(changed_countries)} unchanged, "
+        f"{len(removed_countries)} removed"
+    )
+    if len(changed_countries) == 0 and len(removed_countries) == 0:
+        return []
+
+    polygons_feature_name_to_id, points_feature_name_to_id = [
+        _create_filtered_features(
+            sources_features[source], highest_polygon_id, changed_countries, n_workers
+        )
+        for source in ["polygons", "points"]
+    ]
 
-    feature_name_to_id = _merge_feature_name_to_id_data(
+    changed_feature_name_to_id = _merge_feature_name_to_id_data(
         polygons_feature_name_to_id, points_feature_name_to_id
     )
+    unchanged_feature_name_to_id = (
+        Gazetteer(feature_name_to_id_file_path)._read_countries(
+            [
+                country_name
+                for country_name in checksums
+                if country_name not in changed_feature_name_to_id
+            ]
+        )
+        if len(changed_countries) < len(checksums)
+        else {}
+    )
+    # same countries order as a full build
+    feature_name_to_id = {
+        country_name: changed_feature_name_to_id[country_name]
+        if country_name in changed_feature_name_to_id
+        else unchanged_feature_name_to_id[country_name]
+        for country_name in checksums
+    }
+
+    if _is_gazetteer_db(feature_name_to_id_file_path):
+        _save_feature_names_to_id_db(feature_name_to_id, feature_name_to_id_file_path)
+    else:
+        # save the feature_name_to_id dictionary
+        with open(
+            feature_name_to_id_file_path,
+            "w",
+        ) as f:
+            json.dump(feature_name_to_id, f, indent=4)
+
+    # written last: an interrupted build is fully redone the next time
+    with open(_get_checksums_path(feature_name_to_id_file_path), "w") as f:
+        json.dump(
+            {
+                "build_version": _BUILD_VERSION,
+                "highest_polygon_id": highest_polygon_id,
+                "countries": checksums,
+            },
+            f,
+            indent=4,
+        )
+
+    return changed_countries + sorted(removed_countries)
+
+
+def _prepare_polygons_index(relevant_name_part: str, polygons_index_path: os.PathLike):
+    """
+    Save the STRtree of the polygons and their admin-level hierarchy, for the
+    reverse geocoding of coordinates (`src.reverse_geocoding.ReverseGeocoder`).
+    """
+    highest_polygon_id = int(relevant_name_part[-1])
+    polygons_data_path = f"{relevant_name_part}_polygons.gpkg"
+    if not os.path.exists(polygons_data_path):
+        print(f"{polygons_data_path} not found, the polygons index is not built")
+        return
+
+    polygons = gpd.read_file(
+        polygons_data_path, columns=_get_attribute_columns(highest_polygon_id)
+    )
+    if polygons.crs is not None and polygons.crs.to_epsg() != 4326:
+        polygons = polygons.to_crs(epsg=4326)
 
-    # save the feature_name_to_id dictionary
-    with open(
-        feature_name_to_id_file_path,
-        "w",
-    ) as f:
-        json.dump(feature_name_to_id, f, indent=4)
+    attributes = polygons.drop(columns=polygons.geometry.name).astype(object)
+    attributes = attributes.where(attributes.notna(), None)
+    columns = {column: attributes[column].tolist() for column in attributes}
+
+    locations_hierarchies = [
+        {
+            level: {
+                "id": columns[f"adm{level}_id"][row],
+                "name": columns[f"adm{level}_name"][row],
+                "Pcode": columns[f"adm{level}_src"][row],
+            }
+            for level in range(0, highest_polygon_id + 1)
+            if columns[f"adm{level}_name"][row] is not None
+        }
+        for row in range(len(polygons))
+    ]
+
+    _save_polygons_index(
+        polygons.geometry.values,
+        columns["adm0_name"],
+        locations_hierarchies,
+        polygons_index_path,
+    )
 
 
 if __name__ == "__main__":
-    
+    parser = argparse.ArgumentParser(
+        description="Build feature_name_to_id from the fieldmaps adm4 GeoPackages."
+    )
+    parser.add_argument("--n_workers", type=int, default=os.cpu_count())
+    parser.add_argument(
+        "--force_rebuild", action="store_true", help="Rebuild all the countries."
+    )
+    args = parser.parse_args()
+
     feature_name_to_id_file_path = os.path.join("..", "feature_name_to_id.json")
-    if not os.path.exists(feature_name_to_id_file_path):
-        _prepare_gpkg_data(
-            relevant_name_part="adm4",
-            feature_name_to_id_file_path=feature_name_to_id_file_path,
-        )
-        
+    updated_countries = _prepare_gpkg_data(
+        relevant_name_part="adm4",
+        feature_name_to_id_file_path=feature_name_to_id_file_path,
+        n_workers=args.n_workers,
+        force_rebuild=args.force_rebuild,
+    )
 
     countries_list_path = os.path.join("..", "countries_list.json")
-    if not os.path.exists(countries_list_path):
-        
+    if not os.path.exists(countries_list_path) or len(updated_countries) > 0:
+
         with open("../feature_name_to_id.json", "r") as f:
             feature_name_to_id = json.load(f)
-            
+
         countries_list = list(feature_name_to_id.keys())
         with open(countries_list_path, "w") as f:
-            json.dump(countries_list, f, indent=4)
\ No newline at end of file
+            json.dump(countries_list, f, indent=4)
+
+    feature_name_to_id_db_path = os.path.join("..", "feature_name_to_id.sqlite")
+    if not os.path.exists(feature_name_to_id_db_path) or len(updated_countries) > 0:
+        _convert_json_to_db(feature_name_to_id_file_path, feature_name_to_id_db_path)
+
+    polygons_index_path = os.path.join("..", "adm_polygons_index.pkl")
+    if not os.path.exists(polygons_index_path) or (
+        os.path.exists("adm4_polygons.gpkg")
+        and os.path.getmtime("adm4_polygons.gpkg") > os.path.getmtime(polygons_index_path)
+    ):
+        _prepare_polygons_index("adm4", polygons_index_path)
@@ -1,5 +1,5 @@
 from typing import List
-from src.geolocation_extraction import GeolocationExtractor
+from src.geolocation_extraction import get_geolocation_extractor
 
 
 def extract_geolocations(text: List[str], countries: List[str]) -> dict:
@@ -56,8 +56,9 @@ def extract_geolocations(text: List[str], countries: List[str]) -> dict:
         "location_by_adm_level_4": [[], [], []],
     }
     """
-    extractor = GeolocationExtractor()
-    
+    # models are loaded on the first call and reused by the next ones
+    extractor = get_geolocation_extractor()
+
     outputs = extractor(text, countries=countries)
 
     return outputs
@@ -0,0 +1,140 @@
+from array import array
+from typing import Dict, Hashable, List, Optional, Tuple
+import numpy as np
+
+
+_COLUMNAR_STRING_COLUMNS = [
+    "original",
+    "translated_to_en",
+    "location_id",
+    "location_name",
+    "location_pcode",
+]
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+    except ImportError as e:
+        raise ImportError(
+            "The columnar output requires `pip install pyarrow`"
+        ) from e
+    return pyarrow
+
+
+class _DictionaryEncoder:
+    """
+    Map values to consecutive integer codes, in order of first occurrence.
+    """
+
+    def __init__(self):
+        self.codes: Dict[Hashable, int] = {}
+
+    def encode(self, value: Optional[Hashable]) -> int:
+        """
+        Code of `value`, -1 for `None`.
+        """
+        if value is None:
+            return -1
+        code = self.codes.get(value)
+        if code is None:
+            code = len(self.codes)
+            self.codes[value] = code
+        return code
+
+    def get_dictionary(self) -> List[Hashable]:
+        return list(self.codes.keys())
+
+
+def _get_columnar_outputs(
+    ner_results: List[List[Dict[str, str]]],
+    matched_locations: List[Dict[str, Dict[int, Dict[str, str]]]],
+):
+    """
+    Build the outputs as a `pyarrow.Table` in one pass over the matches, with one row
+    per (document, mention, admin level). Mentions without a match have one row with
+    null admin level and location columns, documents without mention have no row.
+
+    String columns are dictionary-encoded: each distinct name, id or Pcode is stored
+    once, however many mentions refer to it.
+    """
+    pa = _import_pyarrow()
+
+    encoders = {column: _DictionaryEncoder() for column in _COLUMNAR_STRING_COLUMNS}
+    # (id, name, Pcode) -> codes, the same places are matched again and again
+    locations_codes: Dict[Tuple[str, str, str], Tuple[int, int, int]] = {}
+    columns = ["document_id", "mention_id", "admin_level"] + _COLUMNAR_STRING_COLUMNS
+    # row-major integer buffer of all the columns, -1 stands for null
+    rows_values = array("i")
+
+    for document_id, (document_locations, document_matches) in enumerate(
+        zip(ner_results, matched_locations)
+    ):
+        for mention_id, one_location in enumerate(document_locations):
+            original_code = encoders["original"].encode(one_location["original"])
+            translation_code = encoders["translated_to_en"].encode(
+                one_location.get("translated_to_en")
+            )
+            location_hierarchy = document_matches.get(one_location["original"], {})
+
+            rows = []
+            for admin_level in sorted(location_hierarchy):
+                location = location_hierarchy[admin_level]
+                location_key = (location["id"], location["name"], location["Pcode"])
+                if location_key not in locations_codes:
+                    locations_codes[location_key] = tuple(
+                        encoders[column].encode(value)
+                        for column, value in zip(_COLUMNAR_STRING_COLUMNS[2:], location_key)
+                    )
+                rows.append((admin_level, *locations_codes[location_key]))
+            if len(rows) == 0:
+                rows.append((-1, -1, -1, -1))
+
+            for admin_level, id_code, name_code, pcode_code in rows:
+                rows_values.extend(
+                    (
+                        document_id,
+                        mention_id,
+                        admin_level,
+                        original_code,
+                        translation_code,
+                        id_code,
+                        name_code,
+                        pcode_code,
+                    )
+                )
+
+    columns_values = np.frombuffer(rows_values, dtype=np.int32).reshape(-1, len(columns))
+
+    def _to_arrow(column: str, arrow_type):
+        values = columns_values[:, columns.index(column)]
+        return pa.array(
+            values.astype(arrow_type.to_pandas_dtype()), mask=values < 0, type=arrow_type
+        )
+
+    arrays = {
+        "document_id": _to_arrow("document_id", pa.int64()),
+        "mention_id": _to_arrow("mention_id", pa.int32()),
+        "admin_level": _to_arrow("admin_level", pa.int8()),
+    }
+    for column in _COLUMNAR_STRING_COLUMNS:
+        arrays[column] = pa.DictionaryArray.from_arrays(
+            _to_arrow(column, pa.int32()),
+            pa.array(encoders[column].get_dictionary(), type=pa.string()),
+        )
+
+    return pa.table(
+        [arrays[column] for column in columns],
+        names=columns,
+        metadata={"n_documents": str(len(ner_results))},
+    )
+
+
+def save_parquet(table, file_path: str, **kwargs):
+    """
+    Write a columnar output to Parquet, keeping the dictionary encoding.
+    """
+    _import_pyarrow()
+    import pyarrow.parquet as pq
+
+    pq.write_table(table, file_path, **kwargs)
@@ -0,0 +1,96 @@
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterable
+
+
+class DiskCache:
+    """
+    Size-bounded key/value store backed by SQLite.
+
+    With a file path, the cache persists across calls and processes (several
+    processes can share the same file). With the default ":memory:" path it only
+    lives as long as the object. When more than `max_entries` are stored, the
+    least recently used entries are evicted.
+    """
+
+    def __init__(self, path: os.PathLike = ":memory:", max_entries: int = 100_000):
+        self.path = str(path)
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        self._connection = sqlite3.connect(
+            self.path, timeout=30, check_same_thread=False
+        )
+        if self.path != ":memory:":
+            self._connection.execute("PRAGMA journal_mode = WAL")
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS cache "
+                "(key TEXT PRIMARY KEY, value BLOB, last_access REAL)"
+            )
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS cache_last_access ON cache (last_access)"
+            )
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Any]:
+        """
+        Return the cached values of the keys that are in the cache.
+        """
+        keys = list(dict.fromkeys(keys))
+        found = {}
+        with self._lock:
+            # stay under the SQLite variables limit
+            for i in range(0, len(keys), 500):
+                batch = keys[i : i + 500]
+                rows = self._connection.execute(
+                    f"SELECT key, value FROM cache WHERE key IN ({','.join('?' * len(batch))})",
+                    batch,
+                ).fetchall()
+                found.update({key: pickle.loads(value) for key, value in rows})
+
+            if len(found) > 0:
+                now = time.time()
+                with self._connection:
+                    self._connection.executemany(
+                        "UPDATE cache SET last_access = ? WHERE key = ?",
+                        [(now, key) for key in found],
+                    )
+
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def set_many(self, items: Dict[str, Any]):
+        if len(items) == 0:
+            return
+        now = time.time()
+        with self._lock, self._connection:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO cache VALUES (?, ?, ?)",
+                [(key, pickle.dumps(value), now) for key, value in items.items()],
+            )
+            n_entries = self._connection.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+            if n_entries > self.max_entries:
+                self._connection.execute(
+                    "DELETE FROM cache WHERE key IN "
+                    "(SELECT key FROM cache ORDER BY last_access LIMIT ?)",
+                    (n_entries - self.max_entries,),
+                )
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses}
+
+    def clear(self):
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM cache")
+            self.hits = 0
+            self.misses = 0
@@ -0,0 +1,976 @@
+import os
+import json
+import sqlite3
+import threading
+from collections import OrderedDict, defaultdict
+from typing import Any, List, Dict, Hashable, Set, Tuple, Optional
+from fuzzywuzzy import fuzz
+import numpy as np
+from src.metrics import ExtractionMetrics
+
+
+class _GeoNamesMatchIndex:
+    """
+    Prebuilt fuzzy-matching index over the gazetteer names of one country set.
+
+    Keys are normalized once (spaces removed) and a character n-gram inverted
+    index is used to select the keys that can possibly reach the similarity
+    threshold. Only those candidates are scored with `fuzz.partial_ratio`, so
+    the returned match is the same as the one of the linear scan.
+    """
+
+    def __init__(self, geo_names: List[str], ngram_size: int = 3):
+        self.geo_names = list(geo_names)
+        self.geo_names_set = set(self.geo_names)
+        self.ngram_size = ngram_size
+
+        self.no_spaces_keys = [key.replace(" ", "") for key in self.geo_names]
+        self.keys_lengths = np.array([len(key) for key in self.geo_names], dtype=np.int64)
+        self.no_spaces_keys_lengths = np.array(
+            [len(key) for key in self.no_spaces_keys], dtype=np.int64
+        )
+
+        postings = defaultdict(list)
+        keys_duplicated_ngrams = []
+        for key_id, no_spaces_key in enumerate(self.no_spaces_keys):
+            key_ngrams = self._get_ngrams(no_spaces_key)
+            keys_duplicated_ngrams.append(
+                max(len(no_spaces_key) - ngram_size + 1, 0) - len(key_ngrams)
+            )
+            for ngram in key_ngrams:
+                postings[ngram].append(key_id)
+
+        self.postings = {
+            ngram: np.array(key_ids, dtype=np.int64)
+            for ngram, key_ids in postings.items()
+        }
+        self.keys_duplicated_ngrams = np.array(keys_duplicated_ngrams, dtype=np.int64)
+
+    def __len__(self) -> int:
+        return len(self.geo_names)
+
+    def _get_ngrams(self, term: str) -> Set[str]:
+        return {
+            term[i : i + self.ngram_size]
+            for i in range(len(term) - self.ngram_size + 1)
+        }
+
+    def _get_candidates(
+        self,
+        input_term: str,
+        no_spaces_input_term: str,
+        similaritty_threshold: float,
+        length_threshold: float,
+    ) -> np.ndarray:
+        """
+        Return the (sorted) ids of the keys that can pass both thresholds.
+
+        If `partial_ratio` reaches the threshold, the shortest string and the best
+        window of the longest one differ by at most `max_errors` inserted/deleted
+        characters, each of which can destroy at most `ngram_size` shared n-grams.
+        Keys sharing less n-grams than this lower bound cannot match.
+        """
+        q = self.ngram_size
+        term_ngrams = self._get_ngrams(no_spaces_input_term)
+        term_length = len(no_spaces_input_term)
+        term_duplicated_ngrams = max(term_length - q + 1, 0) - len(term_ngrams)
+
+        shared_ngrams = np.zeros(len(self.geo_names), dtype=np.int64)
+        term_postings = [self.postings[ngram] for ngram in term_ngrams if ngram in self.postings]
+        if len(term_postings) > 0:
+            shared_ngrams = np.bincount(
+                np.concatenate(term_postings), minlength=len(self.geo_names)
+            )
+
+        # `fuzz.partial_ratio` compares the shortest string (the input term on ties)
+        term_is_shorter = term_length <= self.no_spaces_keys_lengths
+        shorter_length = np.where(
+            term_is_shorter, term_length, self.no_spaces_keys_lengths
+        )
+        shorter_duplicated_ngrams = np.where(
+            term_is_shorter, term_duplicated_ngrams, self.keys_duplicated_ngrams
+        )
+        min_ratio = (similaritty_threshold - 0.5) / 100
+        max_errors = np.floor((1 - min_ratio) * 2 * shorter_length + 1e-9)
+        min_shared_ngrams = (
+            shorter_length - q + 1 - q * max_errors - shorter_duplicated_ngrams
+        )
+
+        keys_mask = (min_shared_ngrams <= 0) | (shared_ngrams >= min_shared_ngrams)
+        keys_mask &= np.abs(self.keys_lengths - len(input_term)) <= (
+            length_threshold * np.minimum(self.keys_lengths, len(input_term))
+        )
+        return np.nonzero(keys_mask)[0]
+
+    def find_matches(
+        self,
+        input_terms: List[str],
+        similaritty_threshold=95,
+        length_threshold=0.7,
+        metrics: Optional[ExtractionMetrics] = None,
+    ) -> List[str]:
+
+        # Try exact match
+        for one_inpt_term in input_terms:
+            if one_inpt_term in self.geo_names_set:
+                if metrics is not None:
+                    metrics.add("matches_total", kind="exact")
+                return [one_inpt_term]
+
+        best_match, best_score = None, None
+        # Try partial matches on the candidates only
+        for one_input_term in input_terms:
+            no_spaces_input_term = one_input_term.replace(" ", "")
+            candidates = self._get_candidates(
+                one_input_term,
+                no_spaces_input_term,
+                similaritty_threshold,
+                length_threshold,
+            )
+            similarity_scores = [
+                fuzz.partial_ratio(no_spaces_input_term, self.no_spaces_keys[key_id])
+                for key_id in candidates
+            ]
+            if metrics is not None:
+                metrics.add("fuzzy_comparisons_total", len(candidates))
+            for key_id, similarity_score in zip(candidates, similarity_scores):
+                # strict comparison: keep the first best match like the linear scan
+                if similarity_score >= similaritty_threshold and (
+                    best_score is None or similarity_score > best_score
+                ):
+                    best_match, best_score = self.geo_names[key_id], similarity_score
+
+        if metrics is not None:
+            metrics.add("matches_total", kind="fuzzy" if best_match is not None else "none")
+        return [best_match] if best_match is not None else []
+
+    def score_matches(
+        self,
+        input_terms: List[str],
+        similaritty_threshold=95,
+        length_threshold=0.7,
+        metrics: Optional[ExtractionMetrics] = None,
+    ) -> Dict[str, int]:
+        """
+        Return the best partial score of the terms for every name reaching both thresholds.
+        """
+        names_scores = {}
+        for one_input_term in input_terms:
+            no_spaces_input_term = one_input_term.replace(" ", "")
+            candidates = self._get_candidates(
+                one_input_term,
+                no_spaces_input_term,
+                similaritty_threshold,
+                length_threshold,
+            )
+            if metrics is not None:
+                metrics.add("fuzzy_comparisons_total", len(candidates))
+            for key_id in candidates:
+                similarity_score = fuzz.partial_ratio(
+                    no_spaces_input_term, self.no_spaces_keys[key_id]
+                )
+                geo_name = self.geo_names[key_id]
+                if similarity_score >= similaritty_threshold and similarity_score > (
+                    names_scores.get(geo_name, -1)
+                ):
+                    names_scores[geo_name] = similarity_score
+        return names_scores
+
+
+# below this, the candidates of a shard are scored without counting their n-grams
+_MIN_CANDIDATES_TO_COUNT_NGRAMS = 16
+
+
+def _get_pieces_bounds(length: int, n_pieces: int) -> List[Tuple[int, int]]:
+    """
+    (start, end) of `n_pieces` consecutive pieces of about the same length.
+    """
+    return [
+        (i * length // n_pieces, (i + 1) * length // n_pieces) for i in range(n_pieces)
+    ]
+
+
+class _NamesLengthShard(_GeoNamesMatchIndex):
+    """
+    Match index over names of the same length once spaces are removed.
+
+    All the keys share the same error bound, which allows a stronger filter than
+    the n-gram count over the whole index: with at most `e` errors between the
+    shortest string and a window of the other one, one of `e + 1` pieces of the
+    shortest string is left untouched and is a substring of the other one.
+    - keys shorter than the term: the substrings of the term are looked up in a
+    dict of the pieces of the keys,
+    - keys at least as long as the term: the keys containing a piece of the term
+    are the intersection of the postings of its n-grams.
+    No key that can reach the threshold is left out. The n-gram lower bound of
+    `_get_candidates` is only checked when many candidates are left, it costs more
+    than the few `partial_ratio` it saves otherwise.
+    """
+
+    def __init__(self, geo_names: List[str], ngram_size: int = 3):
+        super().__init__(geo_names, ngram_size)
+        self.no_spaces_length = int(self.no_spaces_keys_lengths[0])
+        # pieces of the keys, by number of pieces, built the first time they are needed
+        self._pieces_indexes: Dict[int, Dict[str, List[int]]] = {}
+
+    def _get_pieces_index(self, n_pieces: int) -> Dict[str, List[int]]:
+        if n_pieces not in self._pieces_indexes:
+            pieces_index = defaultdict(list)
+            for key_id, no_spaces_key in enumerate(self.no_spaces_keys):
+                for start, end in _get_pieces_bounds(self.no_spaces_length, n_pieces):
+                    key_ids = pieces_index[no_spaces_key[start:end]]
+                    if len(key_ids) == 0 or key_ids[-1] != key_id:
+                        key_ids.append(key_id)
+            self._pieces_indexes[n_pieces] = dict(pieces_index)
+        return self._pieces_indexes[n_pieces]
+
+    def _get_pieces_candidates(self, no_spaces_input_term: str, max_errors: int) -> np.ndarray:
+        pieces_index = self._get_pieces_index(max_errors + 1)
+        pieces_lengths = {
+            end - start
+            for start, end in _get_pieces_bounds(self.no_spaces_length, max_errors + 1)
+        }
+        candidates = set()
+        for piece_length in pieces_lengths:
+            for start in range(len(no_spaces_input_term) - piece_length + 1):
+                candidates.update(
+                    pieces_index.get(no_spaces_input_term[start : start + piece_length], ())
+                )
+        return np.array(sorted(candidates), dtype=np.int64)
+
+    def _get_substring_candidates(self, no_spaces_piece: str) -> np.ndarray:
+        """
+        Ids of the keys having all the n-grams of the piece, starting from the rarest.
+        """
+        piece_postings = sorted(
+            (self.postings.get(ngram) for ngram in self._get_ngrams(no_spaces_piece)),
+            key=lambda postings: -1 if postings is None else len(postings),
+        )
+        if piece_postings[0] is None:
+            return np.zeros(0, dtype=np.int64)
+        candidates = piece_postings[0]
+        for postings in piece_postings[1:]:
+            positions = np.minimum(np.searchsorted(postings, candidates), len(postings) - 1)
+            candidates = candidates[postings[positions] == candidates]
+            if len(candidates) == 0:
+                break
+        return candidates
+
+    def _get_candidates(
+        self,
+        input_term: str,
+        no_spaces_input_term: str,
+        similaritty_threshold: float,
+        length_threshold: float,
+    ) -> np.ndarray:
+        term_length = len(no_spaces_input_term)
+        term_is_shorter = term_length <= self.no_spaces_length
+        shorter_length = min(term_length, self.no_spaces_length)
+        min_ratio = (similaritty_threshold - 0.5) / 100
+        max_errors = int(np.floor((1 - min_ratio) * 2 * shorter_length + 1e-9))
+
+        if not term_is_shorter and max_errors < self.no_spaces_length:
+            candidates = self._get_pieces_candidates(no_spaces_input_term, max_errors)
+        elif term_is_shorter and term_length // (max_errors + 1) >= self.ngram_size:
+            candidates = np.unique(
+                np.concatenate(
+                    [
+                        self._get_substring_candidates(no_spaces_input_term[start:end])
+                        for start, end in _get_pieces_bounds(term_length, max_errors + 1)
+                    ]
+                )
+            )
+        else:
+            # short strings: nothing to prune with
+            return super()._get_candidates(
+                input_term, no_spaces_input_term, similaritty_threshold, length_threshold
+            )
+
+        keys_lengths = self.keys_lengths[candidates]
+        candidates = candidates[
+            np.abs(keys_lengths - len(input_term))
+            <= length_threshold * np.minimum(keys_lengths, len(input_term))
+        ]
+        if len(candidates) > _MIN_CANDIDATES_TO_COUNT_NGRAMS:
+            candidates = self._filter_shared_ngrams(
+                candidates, no_spaces_input_term, max_errors, term_is_shorter
+            )
+        return candidates
+
+    def _filter_shared_ngrams(
+        self,
+        candidates: np.ndarray,
+        no_spaces_input_term: str,
+        max_errors: int,
+        term_is_shorter: bool,
+    ) -> np.ndarray:
+        """
+        Keep the candidates passing the n-gram lower bound of `_get_candidates`.
+        """
+        q = self.ngram_size
+        term_ngrams = self._get_ngrams(no_spaces_input_term)
+        term_length = len(no_spaces_input_term)
+
+        # postings are sorted by key id
+        shared_ngrams = np.zeros(len(candidates), dtype=np.int64)
+        for ngram in term_ngrams:
+            postings = self.postings.get(ngram)
+            if postings is not None:
+                positions = np.minimum(
+                    np.searchsorted(postings, candidates), len(postings) - 1
+                )
+                shared_ngrams += postings[positions] == candidates
+
+        if term_is_shorter:
+            min_shared_ngrams = term_length - q + 1 - q * max_errors - (
+                max(term_length - q + 1, 0) - len(term_ngrams)
+            )
+        else:
+            min_shared_ngrams = (
+                self.no_spaces_length - q + 1 - q * max_errors
+                - self.keys_duplicated_ngrams[candidates]
+            )
+        return candidates[(min_shared_ngrams <= 0) | (shared_ngrams >= min_shared_ngrams)]
+
+
+class _GlobalNamesIndex:
+    """
+    Names of all the countries, to match locations without knowing their country.
+
+    Unlike the merged `feature_names_to_id` of a country set, every name keeps all
+    its (country, node) entries, so names shared by several countries do not
+    overwrite each other. Fuzzy matching is sharded by name length: a term is only
+    compared with the shards its length allows, and each shard prunes its keys
+    with a filter that only holds for names of one length (see `_NamesLengthShard`),
+    so a lookup costs a few times a single-country lookup, not the size of the world.
+    """
+
+    def __init__(self, countries_feature_names_to_id: Dict[str, Dict[str, Dict]]):
+        self.hierarchies: Dict[str, _AdminHierarchy] = {
+            country_name: _AdminHierarchy(country_data)
+            for country_name, country_data in countries_feature_names_to_id.items()
+        }
+
+        # name -> [(country, node)] of all the countries having this name
+        self.names_entries: Dict[str, List[Tuple[str, int]]] = {}
+        for country_name, hierarchy in self.hierarchies.items():
+            for geo_name, node in hierarchy.name_to_node.items():
+                self.names_entries.setdefault(geo_name, []).append((country_name, node))
+
+        shards_names = defaultdict(list)
+        for geo_name in self.names_entries:
+            shards_names[len(geo_name.replace(" ", ""))].append(geo_name)
+        self.shards: Dict[int, _NamesLengthShard] = {
+            no_spaces_length: _NamesLengthShard(geo_names)
+            for no_spaces_length, geo_names in sorted(shards_names.items())
+        }
+
+    def __len__(self) -> int:
+        return len(self.names_entries)
+
+    def _rank_entries(
+        self,
+        names_scores: Dict[str, int],
+        country_priors: Optional[Dict[str, float]],
+        default_prior: float,
+    ) -> List[Tuple[str, int, str, float]]:
+        candidates = []
+        for geo_name, score in names_scores.items():
+            for country_name, node in self.names_entries[geo_name]:
+                prior = (
+                    country_priors.get(country_name, default_prior)
+                    if country_priors is not None
+                    else 1.0
+                )
+                if prior > 0:
+                    candidates.append((country_name, node, geo_name, score * prior))
+        # stable sort: equal scores keep the order of the terms and countries
+        return sorted(candidates, key=lambda candidate: -candidate[3])
+
+    def find_candidates(
+        self,
+        input_terms: List[str],
+        country_priors: Optional[Dict[str, float]] = None,
+        default_prior: float = 0.5,
+        max_candidates: Optional[int] = None,
+        similaritty_threshold=95,
+        length_threshold=0.7,
+        metrics: Optional[ExtractionMetrics] = None,
+    ) -> List[Tuple[str, int, str, float]]:
+        """
+        Return the ranked `(country, node, name, score)` candidates of the terms.
+
+        Exact matches are returned before any fuzzy match, as in `find_matches`.
+        The score is the similarity weighted by the prior of the country
+        (`default_prior` for the countries missing from `country_priors`); countries
+        with a zero prior are left out, so priors can also restrict the countries.
+        """
+        for one_input_term in input_terms:
+            if one_input_term in self.names_entries:
+                candidates = self._rank_entries(
+                    {one_input_term: 100}, country_priors, default_prior
+                )
+                if len(candidates) > 0:
+                    if metrics is not None:
+                        metrics.add("matches_total", kind="exact")
+                    return candidates[:max_candidates]
+
+        names_scores: Dict[str, int] = {}
+        for one_input_term in input_terms:
+            # keys longer than this cannot pass the length threshold
+            max_length = len(one_input_term) * (1 + length_threshold)
+            for no_spaces_length, shard in self.shards.items():
+                if no_spaces_length > max_length:
+                    break
+                shard_scores = shard.score_matches(
+                    [one_input_term], similaritty_threshold, length_threshold, metrics
+                )
+                for geo_name, score in shard_scores.items():
+                    if score > names_scores.get(geo_name, -1):
+                        names_scores[geo_name] = score
+
+        candidates = self._rank_entries(names_scores, country_priors, default_prior)
+        if metrics is not None:
+            metrics.add("matches_total", kind="fuzzy" if len(candidates) > 0 else "none")
+        return candidates[:max_candidates]
+
+    def get_location_hierarchy(
+        self, country_name: str, geo_name: str
+    ) -> Dict[int, Dict[str, str]]:
+        return self.hierarchies[country_name].get_location_hierarchy(geo_name)
+
+
+class _AdminHierarchy:
+    """
+    Integer-indexed admin hierarchy of the merged `feature_names_to_id` of a country set.
+
+    Every (admin level, geo id) is one node, and every gazetteer name maps to a node.
+    The ancestors of each name are resolved once from its `parent_locations`, by id
+    and with their own Pcode, so places sharing a name in different branches do not
+    collide. Identical ancestor chains are stored once.
+    """
+
+    def __init__(self, feature_names_to_id: Dict[str, Dict]):
+        self.nodes_ids: List[str] = []
+        self.nodes_pcodes: List[Optional[str]] = []
+        self.nodes_levels: List[int] = []
+        nodes_keys: Dict[Tuple[int, str], int] = {}
+
+        self.name_to_node: Dict[str, int] = {}
+        for geo_name, geo_data in feature_names_to_id.items():
+            node_key = (geo_data["admin_level"], geo_data["id"])
+            if node_key not in nodes_keys:
+                nodes_keys[node_key] = len(self.nodes_ids)
+                self.nodes_ids.append(geo_data["id"])
+                self.nodes_pcodes.append(None)
+                self.nodes_levels.append(geo_data["admin_level"])
+            self.nodes_pcodes[nodes_keys[node_key]] = geo_data["Pcode"]
+            self.name_to_node[geo_name] = nodes_keys[node_key]
+
+        # (admin level, id, name, Pcode) of the ancestors of each name, from the country
+        # down. Gazetteers built before parents had a Pcode take the one of the parent's
+        # node, or else of the entry of the parent's name at the same admin level
+        chains: Dict[Tuple, Tuple] = {}
+        self.names_ancestors: Dict[str, Tuple[Tuple[int, str, str, Optional[str]], ...]] = {}
+        for geo_name, geo_data in feature_names_to_id.items():
+            ancestors = []
+            for parent_key, parent_properties in geo_data["parent_locations"].items():
+                admin_level = int(parent_key.split(" ")[1])
+                if "Pcode" in parent_properties:
+                    pcode = parent_properties["Pcode"]
+                else:
+                    pcode = self._get_legacy_parent_pcode(
+                        feature_names_to_id, nodes_keys, admin_level, parent_properties
+                    )
+                ancestors.append(
+                    (admin_level, parent_properties["id"], parent_properties["name"], pcode)
+                )
+            ancestors = tuple(ancestors)
+            self.names_ancestors[geo_name] = chains.setdefault(ancestors, ancestors)
+
+    def _get_legacy_parent_pcode(
+        self,
+        feature_names_to_id: Dict[str, Dict],
+        nodes_keys: Dict[Tuple[int, str], int],
+        admin_level: int,
+        parent_properties: Dict[str, str],
+    ) -> Optional[str]:
+        parent_node = nodes_keys.get((admin_level, parent_properties["id"]))
+        if parent_node is not None:
+            return self.nodes_pcodes[parent_node]
+        parent_entry = feature_names_to_id.get(parent_properties["name"])
+        if parent_entry is not None and parent_entry["admin_level"] == admin_level:
+            return parent_entry["Pcode"]
+        return None
+
+    def __len__(self) -> int:
+        return len(self.nodes_ids)
+
+    def get_location_hierarchy(self, geo_name: str) -> Dict[int, Dict[str, str]]:
+        """
+        Return the `{admin_level: {id, name, Pcode}}` of a gazetteer name and its ancestors.
+        """
+        node = self.name_to_node[geo_name]
+        location_hierarchy = {
+            self.nodes_levels[node]: {
+                "id": self.nodes_ids[node],
+                "name": geo_name,
+                "Pcode": self.nodes_pcodes[node],
+            }
+        }
+        for admin_level, geo_id, name, pcode in self.names_ancestors[geo_name]:
+            location_hierarchy[admin_level] = {"id": geo_id, "name": name, "Pcode": pcode}
+        return location_hierarchy
+
+
+_GAZETTEER_DB_EXTENSIONS = (".sqlite", ".db")
+
+_GAZETTEER_DB_SCHEMA = """
+CREATE TABLE strings (id INTEGER PRIMARY KEY, value);
+CREATE TABLE countries (id INTEGER PRIMARY KEY, name TEXT UNIQUE);
+CREATE TABLE features (
+    country_id INTEGER,
+    row INTEGER,
+    name_id INTEGER,
+    geo_id INTEGER,
+    pcode_id INTEGER,
+    admin_level INTEGER,
+    PRIMARY KEY (country_id, row)
+) WITHOUT ROWID;
+CREATE TABLE parents (
+    country_id INTEGER,
+    row INTEGER,
+    parent_level INTEGER,
+    name_id INTEGER,
+    geo_id INTEGER,
+    pcode_id INTEGER,
+    PRIMARY KEY (country_id, row, parent_level)
+) WITHOUT ROWID;
+"""
+
+
+def _is_gazetteer_db(feature_names_to_id_path: os.PathLike) -> bool:
+    return str(feature_names_to_id_path).endswith(_GAZETTEER_DB_EXTENSIONS)
+
+
+def _save_feature_names_to_id_db(
+    feature_names_to_id: Dict[str, Dict[str, Dict]],
+    db_path: os.PathLike,
+):
+    """
+    Save the `feature_names_to_id` data as an integer-coded SQLite database.
+
+    All the strings (names, ids, Pcodes) are stored once and referenced by id,
+    and the rows of one country are contiguous (clustered on `country_id`), so
+    one country can be read without touching the others.
+    """
+    if os.path.exists(db_path):
+        os.remove(db_path)
+
+    string_ids = {}
+
+    def _get_string_id(value) -> Optional[int]:
+        if value is None:
+            return None
+        key = (type(value).__name__, value)
+        if key not in string_ids:
+            string_ids[key] = len(string_ids)
+        return string_ids[key]
+
+    features_rows, parents_rows = [], []
+    for country_id, (country_name, country_data) in enumerate(
+        feature_names_to_id.items()
+    ):
+        for row, (geo_name, geo_data) in enumerate(country_data.items()):
+            features_rows.append(
+                (
+                    country_id,
+                    row,
+                    _get_string_id(geo_name),
+                    _get_string_id(geo_data["id"]),
+                    _get_string_id(geo_data["Pcode"]),
+                    geo_data["admin_level"],
+                )
+            )
+            for parent_loc_id, parent_properties in geo_data.get(
+                "parent_locations", {}
+            ).items():
+                parents_rows.append(
+                    (
+                        country_id,
+                        row,
+                        int(parent_loc_id.split(" ")[1]),
+                        _get_string_id(parent_properties["name"]),
+                        _get_string_id(parent_properties["id"]),
+                        _get_string_id(parent_properties.get("Pcode")),
+                    )
+                )
+
+    connection = sqlite3.connect(db_path)
+    with connection:
+        connection.executescript(_GAZETTEER_DB_SCHEMA)
+        connection.executemany(
+            "INSERT INTO strings VALUES (?, ?)",
+            ((string_id, value) for (_, value), string_id in string_ids.items()),
+        )
+        connection.executemany(
+            "INSERT INTO countries VALUES (?, ?)",
+            enumerate(feature_names_to_id.keys()),
+        )
+        connection.executemany(
+            "INSERT INTO features VALUES (?, ?, ?, ?, ?, ?)", features_rows
+        )
+        connection.executemany(
+            "INSERT INTO parents VALUES (?, ?, ?, ?, ?, ?)", parents_rows
+        )
+    connection.execute("VACUUM")
+    connection.close()
+
+
+def _convert_json_to_db(json_path: os.PathLike, db_path: os.PathLike):
+    with open(json_path, "r") as f:
+        feature_names_to_id = json.load(f)
+    _save_feature_names_to_id_db(feature_names_to_id, db_path)
+
+
+class _LRUCache:
+    """
+    Small thread-safe mapping keeping at most `max_size` most recently used entries.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._data: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            if key not in self._data:
+                return default
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def put(self, key: Hashable, value: Any):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class Gazetteer:
+    """
+    Long-lived, in-memory view of `feature_name_to_id.json`.
+
+    The path can also point to the integer-coded SQLite format written by
+    `_save_feature_names_to_id_db` (`.sqlite` / `.db`). It is memory-mapped and
+    only the requested countries are read from it.
+
+    Country slices are loaded lazily the first time they are requested and kept
+    in an LRU cache bounded by `max_countries`. The merged names of a country set
+    and their match index are cached as well (bounded by `max_country_sets`), so
+    later batches for the same countries skip both parsing and merging, as is
+    their integer-indexed admin hierarchy (`get_admin_hierarchy`).
+
+    `max_countries` only bounds the slices cached for building new country sets:
+    a cached country set keeps the entries of its countries alive after their
+    slices are evicted, so memory is bounded by both `max_countries` and
+    `max_country_sets`. Only the SQLite format reads countries lazily: with the
+    JSON format, every country missing from the cache costs a `json.load` of the
+    whole file.
+
+    Each country set also keeps the resolved admin-level hierarchy of the terms
+    already matched (bounded by `max_cached_matches`). All the caches are dropped
+    when the gazetteer file changes on disk.
+
+    For texts whose countries are unknown, `get_global_names_index` indexes the
+    names of every country once, without merging them.
+    """
+
+    def __init__(
+        self,
+        feature_names_to_id_path: os.PathLike = os.getenv(
+            "FEATURE_NAMES_TO_ID_PATH", os.path.join("data", "feature_name_to_id.json")
+        ),
+        max_countries: int = int(os.getenv("GAZETTEER_MAX_COUNTRIES", 32)),
+        max_country_sets: int = int(os.getenv("GAZETTEER_MAX_COUNTRY_SETS", 8)),
+        max_cached_matches: int = int(os.getenv("GAZETTEER_MAX_CACHED_MATCHES", 50_000)),
+    ):
+        self.feature_names_to_id_path = feature_names_to_id_path
+        self.max_countries = max_countries
+        self.max_country_sets = max_country_sets
+        self.max_cached_matches = max_cached_matches
+
+        self._countries: "OrderedDict[str, Dict[str, Dict]]" = OrderedDict()
+        self._country_sets: "OrderedDict[Tuple[str, ...], Tuple[Dict, _GeoNamesMatchIndex]]" = (
+            OrderedDict()
+        )
+        self._matches_caches: Dict[Tuple[str, ...], _LRUCache] = {}
+        self._hierarchies: Dict[Tuple[str, ...], _AdminHierarchy] = {}
+        self._available_countries: Optional[Set[str]] = None
+        self._global_names_index: Optional[_GlobalNamesIndex] = None
+        self._global_matches_cache: Optional[_LRUCache] = None
+        self._db_connection: Optional[sqlite3.Connection] = None
+        self._lock = threading.RLock()
+        self.version: Optional[Tuple[int, int]] = None
+
+    def _get_file_version(self) -> Optional[Tuple[int, int]]:
+        if not os.path.exists(self.feature_names_to_id_path):
+            return None
+        file_stats = os.stat(self.feature_names_to_id_path)
+        return (file_stats.st_mtime_ns, file_stats.st_size)
+
+    def _check_file_version(self):
+        """
+        Drop every cached country, index and match if the gazetteer file changed.
+        """
+        file_version = self._get_file_version()
+        if file_version != self.version:
+            if self.version is not None:
+                self.clear()
+            self.version = file_version
+
+    def _get_db_connection(self) -> sqlite3.Connection:
+        if self._db_connection is None:
+            self._db_connection = sqlite3.connect(
+                f"file:{self.feature_names_to_id_path}?mode=ro",
+                uri=True,
+                check_same_thread=False,
+            )
+            self._db_connection.execute(
+                f"PRAGMA mmap_size = {os.path.getsize(self.feature_names_to_id_path)}"
+            )
+        return self._db_connection
+
+    def _read_countries_from_db(
+        self, country_names: List[str]
+    ) -> Dict[str, Dict[str, Dict]]:
+        connection = self._get_db_connection()
+        country_ids = dict(connection.execute("SELECT name, id FROM countries"))
+        self._available_countries = set(country_ids.keys())
+        # databases written before the parents had a Pcode
+        has_parents_pcodes = "pcode_id" in [
+            column[1] for column in connection.execute("PRAGMA table_info(parents)")
+        ]
+        parents_pcode = "c.value" if has_parents_pcodes else "NULL"
+        parents_pcode_join = (
+            "LEFT JOIN strings c ON c.id = p.pcode_id" if has_parents_pcodes else ""
+        )
+
+        countries_data = {}
+        for country_name in country_names:
+            if country_name not in country_ids:
+                continue
+            country_id = country_ids[country_name]
+
+            parent_locations = defaultdict(dict)
+            for row, parent_level, parent_name, parent_id, parent_pcode in connection.execute(
+                f"""
+                SELECT p.row, p.parent_level, n.value, g.value, {parents_pcode} FROM parents p
+                JOIN strings n ON n.id = p.name_id
+                LEFT JOIN strings g ON g.id = p.geo_id
+                {parents_pcode_join}
+                WHERE p.country_id = ? ORDER BY p.row, p.parent_level
+                """,
+                (country_id,),
+            ):
+                parent_locations[row][f"parent {parent_level}"] = {
+                    "name": parent_name,
+                    "id": parent_id,
+                }
+                if has_parents_pcodes:
+                    parent_locations[row][f"parent {parent_level}"]["Pcode"] = parent_pcode
+
+            country_data = {}
+            for row, geo_name, geo_id, pcode, admin_level in connection.execute(
+                """
+                SELECT f.row, n.value, g.value, p.value, f.admin_level FROM features f
+                JOIN strings n ON n.id = f.name_id
+                LEFT JOIN strings g ON g.id = f.geo_id
+                LEFT JOIN strings p ON p.id = f.pcode_id
+                WHERE f.country_id = ? ORDER BY f.row
+                """,
+                (country_id,),
+            ):
+                country_data[geo_name] = {
+                    "id": geo_id,
+                    "Pcode": pcode,
+                    "admin_level": admin_level,
+                    "parent_locations": parent_locations.get(row, {}),
+                }
+            countries_data[country_name] = country_data
+
+        return countries_data
+
+    def _read_countries(self, country_names: List[str]) -> Dict[str, Dict[str, Dict]]:
+        if _is_gazetteer_db(self.feature_names_to_id_path):
+            return self._read_countries_from_db(country_names)
+
+        with open(self.feature_names_to_id_path, "r") as f:
+            feature_names_to_id = json.load(f)
+
+        self._available_countries = set(feature_names_to_id.keys())
+        return {
+            country_name: feature_names_to_id[country_name]
+            for country_name in country_names
+            if country_name in feature_names_to_id
+        }
+
+    def _read_all_countries(self) -> Dict[str, Dict[str, Dict]]:
+        if _is_gazetteer_db(self.feature_names_to_id_path):
+            country_names = [
+                country_name
+                for (country_name,) in self._get_db_connection().execute(
+                    "SELECT name FROM countries ORDER BY id"
+                )
+            ]
+            return self._read_countries_from_db(country_names)
+
+        with open(self.feature_names_to_id_path, "r") as f:
+            feature_names_to_id = json.load(f)
+        self._available_countries = set(feature_names_to_id.keys())
+        return feature_names_to_id
+
+    def _load_countries(self, country_names: List[str]) -> Dict[str, Dict[str, Dict]]:
+        """
+        Return the requested country slices, reading the missing ones from disk
+        in a single pass.
+        """
+        loaded_countries = {}
+        missing_countries = []
+        for country_name in country_names:
+            if country_name in self._countries:
+                self._countries.move_to_end(country_name)
+                loaded_countries[country_name] = self._countries[country_name]
+            elif (
+                self._available_countries is None
+                or country_name in self._available_countries
+            ):
+                missing_countries.append(country_name)
+
+        if len(missing_countries) > 0:
+            for country_name, country_data in self._read_countries(
+                missing_countries
+            ).items():
+                loaded_countries[country_name] = country_data
+                self._countries[country_name] = country_data
+                while len(self._countries) > self.max_countries:
+                    self._countries.popitem(last=False)
+
+        return loaded_countries
+
+    def get_feature_names_to_id(
+        self, country_names: List[str]
+    ) -> Tuple[Dict[str, Dict], _GeoNamesMatchIndex]:
+        """
+        Return the merged `feature_names_to_id` of the countries and its match index.
+        """
+        country_set = tuple(sorted(set(country_names)))
+
+        with self._lock:
+            self._check_file_version()
+            if country_set in self._country_sets:
+                self._country_sets.move_to_end(country_set)
+                return self._country_sets[country_set]
+
+            loaded_countries = self._load_countries(list(country_set))
+
+            country_specific_feature_names_to_id = {}
+            # the missing countries are counted by `missing_countries_total`
+            for country_name in country_set:
+                if country_name not in loaded_countries:
+                    continue
+                country_specific_feature_names_to_id.update(
+                    loaded_countries[country_name]
+                )
+
+            match_index = _GeoNamesMatchIndex(
+                list(country_specific_feature_names_to_id.keys())
+            )
+
+            self._country_sets[country_set] = (
+                country_specific_feature_names_to_id,
+                match_index,
+            )
+            self._matches_caches[country_set] = _LRUCache(self.max_cached_matches)
+            while len(self._country_sets) > self.max_country_sets:
+                evicted_country_set, _ = self._country_sets.popitem(last=False)
+                del self._matches_caches[evicted_country_set]
+                self._hierarchies.pop(evicted_country_set, None)
+
+            return self._country_sets[country_set]
+
+    def get_missing_countries(self, country_names: List[str]) -> List[str]:
+        """
+        Return the countries of `country_names` missing from the gazetteer file.
+        """
+        with self._lock:
+            self.get_feature_names_to_id(country_names)
+            if self._available_countries is None:
+                return []
+            return [
+                country_name
+                for country_name in dict.fromkeys(country_names)
+                if country_name not in self._available_countries
+            ]
+
+    def get_matches_cache(self, country_names: List[str]) -> _LRUCache:
+        """
+        Return the cache of resolved matches of the country set, keyed by the input terms.
+        """
+        country_set = tuple(sorted(set(country_names)))
+        with self._lock:
+            if country_set not in self._matches_caches:
+                self.get_feature_names_to_id(country_names)
+            return self._matches_caches[country_set]
+
+    def get_admin_hierarchy(self, country_names: List[str]) -> _AdminHierarchy:
+        """
+        Return the admin hierarchy of the country set, built on the first call.
+        """
+        country_set = tuple(sorted(set(country_names)))
+        with self._lock:
+            feature_names_to_id, _ = self.get_feature_names_to_id(country_names)
+            if country_set not in self._hierarchies:
+                self._hierarchies[country_set] = _AdminHierarchy(feature_names_to_id)
+            return self._hierarchies[country_set]
+
+    def get_global_names_index(self) -> _GlobalNamesIndex:
+        """
+        Return the names index of all the countries, built on the first call.
+        The countries are read for the index only, the LRU of countries is left as is.
+        """
+        with self._lock:
+            self._check_file_version()
+            if self._global_names_index is None:
+                self._global_names_index = _GlobalNamesIndex(self._read_all_countries())
+                self._global_matches_cache = _LRUCache(self.max_cached_matches)
+            return self._global_names_index
+
+    def get_global_matches_cache(self) -> _LRUCache:
+        """
+        Return the cache of the matches resolved through the global names index.
+        """
+        with self._lock:
+            self.get_global_names_index()
+            return self._global_matches_cache
+
+    def clear(self):
+        with self._lock:
+            self._global_names_index = None
+            self._global_matches_cache = None
+            self._countries.clear()
+            self._country_sets.clear()
+            self._matches_caches.clear()
+            self._hierarchies.clear()
+            self._available_countries = None
+            if self._db_connection is not None:
+                self._db_connection.close()
+                self._db_connection = None
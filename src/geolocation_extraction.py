@@ -1,12 +1,32 @@
-from transformers import AutoTokenizer, AutoModelForTokenClassification, MarianTokenizer, MarianMTModel
-from transformers import pipeline
-from typing import Any, List, Dict, Union
+from transformers import MarianTokenizer, MarianMTModel
+from typing import Any, Callable, Iterable, Iterator, List, Dict, Tuple, Union, Optional
 import torch
 from tqdm import tqdm
-from src.get_polygons import _match_locations_to_maps_data
+from src.get_polygons import _match_locations_to_maps_data, _get_mapped_country_names
+from src.gazetteer import Gazetteer
+from src.model_registry import get_ner_pipeline, get_mt_model, get_cached
+from src.disk_cache import DiskCache
+from src.metrics import ExtractionMetrics
+from src.columnar import _get_columnar_outputs
+from src.reverse_geocoding import ReverseGeocoder, _extract_coordinates
+from src.inference_workers import InferenceWorkers
+from src.streaming import _iter_chunks, _run_pipeline
 import os
-from langdetect import detect
+import re
+import json
+import copy
+import hashlib
+import unicodedata
+from langdetect import DetectorFactory, detect_langs
+from langdetect.lang_detect_exception import LangDetectException
 import gc
+import math
+
+# langdetect is random by default: make the language decisions reproducible
+DetectorFactory.seed = 0
+
+# added to the output cap of the translations, for names of one or two tokens
+_TRANSLATION_EXTRA_TOKENS = 4
 
 
 def _get_adm_n_locations(
@@ -25,6 +45,66 @@ def _get_adm_n_locations(
             addded_location_ids.add(extracted_loc_data[adm_level]["id"])
     return adm_n_locations
 
+def _get_outputs(
+    ner_results: List[List[Dict[str, str]]],
+    matched_locations: List[Dict[str, Dict[int, Dict[str, str]]]],
+) -> Dict[str, List[Any]]:
+    outputs = {
+        "geolocations": ner_results,
+        "geolocation_by_admin_level": matched_locations,
+    }
+
+    for admin_lvl in range(5):
+        adm_n_locations = [
+            _get_adm_n_locations(matched_locations_one_entry, admin_lvl)
+            for matched_locations_one_entry in matched_locations
+        ]
+        outputs[f"location_by_adm_level_{admin_lvl}"] = adm_n_locations
+
+    return outputs
+
+
+def _check_output_format(output_format: str):
+    if output_format not in ["nested", "arrow", "pandas"]:
+        raise ValueError(
+            f"Unknown output format {output_format}, expected nested, arrow or pandas"
+        )
+
+
+def _normalize_document(text: str) -> str:
+    """
+    Unicode (NFKC) and whitespace normalization, so that reposts differing only
+    by their encoding or spacing share the same document cache entry.
+    """
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFKC", text)).strip()
+
+
+def _merge_windows_entities(
+    entities: List[Tuple[int, int, str]],
+) -> List[Tuple[int, int, str]]:
+    """
+    Merge the (start, end, word) entities found in the overlapping windows of one text:
+    entities are sorted by position and, among overlapping spans, the longest one is
+    kept (an entity cut by a window edge is complete in the next window).
+    """
+    merged_entities = []
+    for start, end, word in sorted(entities, key=lambda x: (x[0], -(x[1] - x[0]))):
+        if len(merged_entities) > 0 and start < merged_entities[-1][1]:
+            if end - start > merged_entities[-1][1] - merged_entities[-1][0]:
+                merged_entities[-1] = (start, end, word)
+            continue
+        merged_entities.append((start, end, word))
+    return merged_entities
+
+
+def _is_latin_script(text: str) -> bool:
+    return all(
+        unicodedata.name(character, "").startswith("LATIN")
+        for character in text
+        if character.isalpha()
+    )
+
+
 def _get_device():
     if torch.cuda.is_available():
         return "cuda"
@@ -43,145 +123,923 @@ class GeolocationExtractor:
         mt_to_en_model: str = os.getenv(
             "MT_TO_EN_MODEL_NAME", "Helsinki-NLP/opus-mt-mul-en"
         ),
+        gazetteer: Optional[Gazetteer] = None,
+        device: Optional[str] = None,
+        lazy_translation_model: bool = False,
+        translation_cache_path: Optional[os.PathLike] = os.getenv(
+            "TRANSLATION_CACHE_PATH"
+        ),
+        translation_cache_size: int = int(os.getenv("TRANSLATION_CACHE_SIZE", 100_000)),
+        ner_max_batch_tokens: Optional[int] = (
+            int(os.getenv("NER_MAX_BATCH_TOKENS"))
+            if os.getenv("NER_MAX_BATCH_TOKENS")
+            else None
+        ),
+        collect_garbage: bool = True,
+        matching_workers: int = int(os.getenv("MATCHING_WORKERS", 1)),
+        split_long_texts: bool = True,
+        ner_window_tokens: Optional[int] = None,
+        ner_window_overlap: int = 64,
+        min_language_probability: float = float(
+            os.getenv("MIN_LANGUAGE_PROBABILITY", 0.9)
+        ),
+        backend: str = os.getenv("INFERENCE_BACKEND", "torch"),
+        metrics_callback: Optional[Callable[[ExtractionMetrics], None]] = None,
+        show_progress_bars: bool = os.getenv("GEO_EXTRACT_PROGRESS_BARS", "1") != "0",
+        reverse_geocoder: Optional[ReverseGeocoder] = None,
+        document_cache_path: Optional[os.PathLike] = os.getenv("DOCUMENT_CACHE_PATH"),
+        document_cache_size: int = int(os.getenv("DOCUMENT_CACHE_SIZE", 100_000)),
+        translation_batch_size: int = int(os.getenv("TRANSLATION_BATCH_SIZE", 64)),
+        translation_num_beams: Optional[int] = (
+            int(os.getenv("TRANSLATION_NUM_BEAMS"))
+            if os.getenv("TRANSLATION_NUM_BEAMS")
+            else None
+        ),
+        translation_max_length_ratio: Optional[float] = (
+            float(os.getenv("TRANSLATION_MAX_LENGTH_RATIO"))
+            if os.getenv("TRANSLATION_MAX_LENGTH_RATIO")
+            else None
+        ),
+        inference_workers: int = int(os.getenv("INFERENCE_WORKERS", 1)),
+        inference_threads_per_worker: Optional[int] = (
+            int(os.getenv("INFERENCE_THREADS_PER_WORKER"))
+            if os.getenv("INFERENCE_THREADS_PER_WORKER")
+            else None
+        ),
     ):
 
-        tokenizer = AutoTokenizer.from_pretrained(model_name)
-        model = AutoModelForTokenClassification.from_pretrained(model_name)
-        self.device = _get_device()
-        self.nlp_ner = pipeline(
-            "ner",
-            model=model,
-            tokenizer=tokenizer,
-            grouped_entities=True,
-            device=self.device,
-        )
+        self.device = device if device is not None else _get_device()
+        # models are shared through the process-wide registry
+        # "torch", or on cpu "torch-int8" (dynamic quantization) / "onnx" (ONNX Runtime)
+        self.backend = backend
+        self.ner_model_name = model_name
+        self.nlp_ner = get_ner_pipeline(model_name, self.device, backend)
+        self.ner_max_batch_tokens = ner_max_batch_tokens
+        self.collect_garbage = collect_garbage
+        self.matching_workers = matching_workers
+        # long texts are split in windows of `ner_window_tokens` (model max length by default)
+        self.split_long_texts = split_long_texts
+        self.ner_window_tokens = ner_window_tokens
+        self.ner_window_overlap = ner_window_overlap
         self.do_translation = translate_to_english
-        if self.do_translation:
-            self.mt_to_en_tokenizer = MarianTokenizer.from_pretrained(mt_to_en_model)
-            self.mt_to_en_model = MarianMTModel.from_pretrained(mt_to_en_model)
-            self.mt_to_en_model.to(self.device)
+        self.mt_to_en_model_name = mt_to_en_model
+        self.min_language_probability = min_language_probability
+        self._mt_to_en = None
+        # location names are a few tokens long: they are translated in batches of
+        # similar lengths. `translation_num_beams` and a cap of
+        # `translation_max_length_ratio` times the token length of each name (+ a few
+        # tokens) bound the decoding; None keeps the model's generation config
+        self.translation_batch_size = translation_batch_size
+        self.translation_num_beams = translation_num_beams
+        self.translation_max_length_ratio = translation_max_length_ratio
+        if self.do_translation and not lazy_translation_model:
+            self._load_translation_model()
+        # keyed by (MT model, location name), persisted on disk if a path is given
+        self.translation_cache = DiskCache(
+            translation_cache_path if translation_cache_path else ":memory:",
+            max_entries=translation_cache_size,
+        )
+
+        # kept for the lifetime of the extractor: countries are loaded once
+        self.gazetteer = gazetteer if gazetteer is not None else Gazetteer()
+
+        # cumulative metrics of all the calls; `metrics_callback` gets the metrics of each call
+        self.metrics = ExtractionMetrics()
+        self.metrics_callback = metrics_callback
+        self.show_progress_bars = show_progress_bars
+        # if given, decimal coordinates of the texts are resolved against the polygons
+        self.reverse_geocoder = reverse_geocoder
+        # outputs of each document, keyed by its normalized content and the settings
+        # it was processed with; shared by the processes using the same file
+        self.document_cache = (
+            DiskCache(document_cache_path, max_entries=document_cache_size)
+            if document_cache_path
+            else None
+        )
+        # on cpu, NER and translation batches are spread over forked processes
+        # sharing the models; forked on the first call
+        self.inference_pool = (
+            InferenceWorkers(self, inference_workers, inference_threads_per_worker)
+            if inference_workers > 1
+            else None
+        )
+
+    def close(self):
+        """
+        Stop the inference worker processes, if any.
+        """
+        if self.inference_pool is not None:
+            self.inference_pool.close()
+
+    def _report_metrics(self, call_metrics: ExtractionMetrics):
+        self.metrics.merge(call_metrics)
+        if self.metrics_callback is not None:
+            self.metrics_callback(call_metrics)
+
+    def _load_translation_model(self):
+        if self._mt_to_en is None:
+            self._mt_to_en = get_mt_model(
+                self.mt_to_en_model_name, self.device, self.backend
+            )
+        return self._mt_to_en
+
+    @property
+    def mt_to_en_tokenizer(self) -> MarianTokenizer:
+        return self._load_translation_model()[0]
+
+    @property
+    def mt_to_en_model(self) -> MarianMTModel:
+        return self._load_translation_model()[1]
+
+    def _get_translation_settings(self) -> List[Any]:
+        # the translations depend on the decoding settings, not on the batch size
+        return [
+            self.mt_to_en_model_name,
+            self.translation_num_beams,
+            self.translation_max_length_ratio,
+        ]
+
+    def _get_max_new_tokens(self, input_length: int) -> Optional[int]:
+        if self.translation_max_length_ratio is None:
+            return None
+        return (
+            math.ceil(input_length * self.translation_max_length_ratio)
+            + _TRANSLATION_EXTRA_TOKENS
+        )
+
+    def _get_generation_kwargs(self, max_new_tokens: Optional[int]) -> Dict[str, int]:
+        generation_kwargs = {}
+        if self.translation_num_beams is not None:
+            generation_kwargs["num_beams"] = self.translation_num_beams
+        if max_new_tokens is not None:
+            generation_kwargs["max_new_tokens"] = max_new_tokens
+        return generation_kwargs
 
     @torch.no_grad()
     def _translate_loc_to_english(
-        self, text: List[str], batch_size: int = 8
+        self, text: List[str], batch_size: Optional[int] = None
     ) -> List[str]:
+        """
+        Names are sorted by token length so that the batches hold names of similar
+        lengths. A batch only holds names with the same output cap, so the
+        translation of a name does not depend on the names translated with it.
+        Translations keep the input order.
+        """
+        if len(text) == 0:
+            # nothing to translate: do not load the translation model
+            return []
+        if batch_size is None:
+            batch_size = self.translation_batch_size
 
-        translations = []
-        for i in tqdm(
-            range(0, len(text), batch_size),
+        texts_lengths = [
+            len(input_ids) for input_ids in self.mt_to_en_tokenizer(text)["input_ids"]
+        ]
+        sorted_text_ids = sorted(range(len(text)), key=lambda i: texts_lengths[i])
+
+        batches, batch = [], []
+        for text_id in sorted_text_ids:
+            if len(batch) > 0 and (
+                len(batch) >= batch_size
+                or self._get_max_new_tokens(texts_lengths[text_id])
+                != self._get_max_new_tokens(texts_lengths[batch[0]])
+            ):
+                batches.append(batch)
+                batch = []
+            batch.append(text_id)
+        batches.append(batch)
+
+        translations = [None] * len(text)
+        for batch_text_ids in tqdm(
+            batches,
             desc="Translating locations to english",
+            disable=not self.show_progress_bars,
         ):
-            batch = text[i : i + batch_size]
-            encoded = self.mt_to_en_tokenizer(batch, return_tensors="pt").to(self.device)
+            encoded = self.mt_to_en_tokenizer(
+                [text[text_id] for text_id in batch_text_ids],
+                return_tensors="pt",
+                padding=True,
+            ).to(self.device)
             # Move inputs to CPU for MPS compatibility if needed
             if self.device == "mps":
                 encoded = {k: v.cpu() for k,v in encoded.items()}
-                translated = self.mt_to_en_model.generate(**encoded)
-            else:
-                translated = self.mt_to_en_model.generate(**encoded)
-            translations.extend(
-                [self.mt_to_en_tokenizer.decode(t, skip_special_tokens=True) for t in translated]
+            translated = self.mt_to_en_model.generate(
+                **encoded,
+                **self._get_generation_kwargs(
+                    self._get_max_new_tokens(texts_lengths[batch_text_ids[0]])
+                ),
             )
+            for text_id, t in zip(batch_text_ids, translated):
+                translations[text_id] = self.mt_to_en_tokenizer.decode(
+                    t, skip_special_tokens=True
+                )
+        if self.collect_garbage:
             gc.collect()
         return translations
 
+    def _get_ner_window_tokens(self) -> int:
+        if self.ner_window_tokens is not None:
+            return self.ner_window_tokens
+        max_length = min(
+            self.nlp_ner.tokenizer.model_max_length,
+            getattr(self.nlp_ner.model.config, "max_position_embeddings", 512),
+        )
+        return max_length - self.nlp_ner.tokenizer.num_special_tokens_to_add()
+
+    def _split_into_windows(self, text: List[str]) -> Tuple[List[str], List[int], List[int], List[int]]:
+        """
+        Split the texts longer than the model's maximum length into overlapping
+        windows of whole words (`ner_window_overlap` tokens shared by consecutive windows).
+
+        Returns the text of every window, the index of its source text, the character
+        offset of the window in the source text and its length in tokens.
+        """
+        window_tokens = self._get_ner_window_tokens()
+        n_special_tokens = self.nlp_ner.tokenizer.num_special_tokens_to_add()
+        encodings = self.nlp_ner.tokenizer(
+            text, add_special_tokens=False, return_offsets_mapping=True
+        )
+
+        windows, windows_text_ids, windows_offsets, windows_lengths = [], [], [], []
+        for text_id, one_text in enumerate(text):
+            offsets = encodings["offset_mapping"][text_id]
+            n_tokens = len(offsets)
+            if n_tokens <= window_tokens:
+                windows.append(one_text)
+                windows_text_ids.append(text_id)
+                windows_offsets.append(0)
+                windows_lengths.append(n_tokens + n_special_tokens)
+                continue
+
+            word_ids = encodings.word_ids(text_id)
+
+            def _is_word_start(token_id: int) -> bool:
+                return word_ids[token_id] != word_ids[token_id - 1]
+
+            start = 0
+            while True:
+                end = min(start + window_tokens, n_tokens)
+                if end < n_tokens:
+                    # do not cut a word in two (unless it is longer than the window)
+                    word_end = end
+                    while word_end > start + 1 and not _is_word_start(word_end):
+                        word_end -= 1
+                    if word_end > start + 1:
+                        end = word_end
+
+                window_start_char = offsets[start][0]
+                windows.append(one_text[window_start_char : offsets[end - 1][1]])
+                windows_text_ids.append(text_id)
+                windows_offsets.append(window_start_char)
+                windows_lengths.append(end - start + n_special_tokens)
+
+                if end >= n_tokens:
+                    break
+                next_start = max(end - self.ner_window_overlap, start + 1)
+                while next_start > start + 1 and not _is_word_start(next_start):
+                    next_start -= 1
+                start = next_start
+
+        return windows, windows_text_ids, windows_offsets, windows_lengths
+
+    def _get_token_budget_batches(
+        self,
+        text: List[str],
+        batch_size: int,
+        max_batch_tokens: int,
+        texts_lengths: Optional[List[int]] = None,
+    ) -> List[List[int]]:
+        """
+        Group texts of similar token length together: each batch holds at most
+        `batch_size` texts and `max_batch_tokens` tokens once padded to its longest text.
+        Returns the indices of the texts of each batch.
+        """
+        if texts_lengths is None:
+            texts_lengths = [
+                len(input_ids)
+                for input_ids in self.nlp_ner.tokenizer(text, truncation=True)["input_ids"]
+            ]
+        sorted_text_ids = sorted(range(len(text)), key=lambda i: texts_lengths[i])
+
+        batches, batch = [], []
+        for text_id in sorted_text_ids:
+            # texts are sorted by length: the new text is the longest of the batch
+            if len(batch) > 0 and (
+                len(batch) >= batch_size
+                or (len(batch) + 1) * texts_lengths[text_id] > max_batch_tokens
+            ):
+                batches.append(batch)
+                batch = []
+            batch.append(text_id)
+        if len(batch) > 0:
+            batches.append(batch)
+
+        return batches
+
     @torch.no_grad()
     def extract_locations(
-        self, text: List[str], batch_size: int = 32
+        self,
+        text: List[str],
+        batch_size: int = 32,
+        max_batch_tokens: Optional[int] = None,
+        metrics: Optional[ExtractionMetrics] = None,
     ) -> List[Dict[str, str]]:
-        ner_results = []
-        for i in tqdm(range(0, len(text), batch_size), desc="Extracting locations"):
-            batch = text[i : i + batch_size]
-            batch_results = self.nlp_ner(batch)
+        """
+        Texts longer than the model's maximum length are split into overlapping
+        windows, which are batched together with the other texts; the entities
+        found in the windows of one text are merged and deduplicated.
 
-            gc.collect()
+        If `max_batch_tokens` is set (defaults to the extractor's `ner_max_batch_tokens`),
+        texts are bucketed by token length instead of being cut in arrival order.
+        Results are always returned in the order of `text`.
+        """
+        if metrics is None:
+            metrics = ExtractionMetrics()
+        with metrics.time_stage("ner"):
+            if self.inference_pool is not None and len(text) > 1:
+                ner_results = self.inference_pool.extract_locations(
+                    text, batch_size, max_batch_tokens
+                )
+            else:
+                ner_results = self._extract_locations(text, batch_size, max_batch_tokens)
+        if self.reverse_geocoder is not None:
+            for one_text, text_locations in zip(text, ner_results):
+                text_locations.extend(
+                    {"original": original, "latitude": latitude, "longitude": longitude}
+                    for original, latitude, longitude in _extract_coordinates(one_text)
+                )
+        metrics.add("documents_total", len(text))
+        metrics.add("entities_total", sum(len(locs) for locs in ner_results))
+        return ner_results
+
+    def _extract_locations(
+        self,
+        text: List[str],
+        batch_size: int,
+        max_batch_tokens: Optional[int],
+    ) -> List[List[Dict[str, str]]]:
+        if max_batch_tokens is None:
+            max_batch_tokens = self.ner_max_batch_tokens
+
+        if self.split_long_texts and self.nlp_ner.tokenizer.is_fast:
+            windows, windows_text_ids, windows_offsets, windows_lengths = (
+                self._split_into_windows(text)
+            )
+        else:
+            windows, windows_text_ids, windows_offsets, windows_lengths = (
+                text,
+                list(range(len(text))),
+                [0] * len(text),
+                None,
+            )
+
+        if max_batch_tokens is None:
+            batches = [
+                list(range(i, min(i + batch_size, len(windows))))
+                for i in range(0, len(windows), batch_size)
+            ]
+        else:
+            batches = self._get_token_budget_batches(
+                windows, batch_size, max_batch_tokens, windows_lengths
+            )
+
+        texts_entities = [[] for _ in range(len(text))]
+        texts_n_windows = [0] * len(text)
+        for batch_ids in tqdm(
+            batches, desc="Extracting locations", disable=not self.show_progress_bars
+        ):
+            batch = [windows[i] for i in batch_ids]
+            if max_batch_tokens is None:
+                batch_results = self.nlp_ner(batch)
+            else:
+                # texts have similar lengths: run them as one padded model batch
+                batch_results = self.nlp_ner(batch, batch_size=len(batch))
+
+            if self.collect_garbage:
+                gc.collect()
+
+            for window_id, entry_results in zip(batch_ids, batch_results):
+                text_id = windows_text_ids[window_id]
+                texts_n_windows[text_id] += 1
+                for entity in entry_results:
+                    if entity["entity_group"] == "LOC":
+                        texts_entities[text_id].append(
+                            (
+                                entity["start"] + windows_offsets[window_id]
+                                if entity.get("start") is not None
+                                else None,
+                                entity["end"] + windows_offsets[window_id]
+                                if entity.get("end") is not None
+                                else None,
+                                entity["word"],
+                            )
+                        )
 
-            # Flatten and filter locations
-            for entry_results in batch_results:
-                locations = [
-                    {"original": entity["word"]}
-                    for entity in entry_results
-                    if entity["entity_group"] == "LOC"
-                ]
-                ner_results.append(locations)
+        ner_results = []
+        for text_entities, n_windows in zip(texts_entities, texts_n_windows):
+            if n_windows > 1:
+                text_entities = _merge_windows_entities(text_entities)
+            ner_results.append([{"original": word} for _, _, word in text_entities])
 
         return ner_results
 
-    @torch.no_grad()
-    def _do_translations(
-        self, ner_results: List[Dict[str, str]], batch_size: int = 8
-    ) -> List[List[str]]:
+    def _translate_with_cache(
+        self,
+        text: List[str],
+        batch_size: Optional[int] = None,
+        metrics: Optional[ExtractionMetrics] = None,
+    ) -> Dict[str, str]:
+        """
+        Translate unique location names, only sending the ones missing from the
+        translation cache to the MT model.
+        """
+        if batch_size is None:
+            batch_size = self.translation_batch_size
+        cache_keys = {
+            one_text: json.dumps(self._get_translation_settings() + [one_text])
+            for one_text in text
+        }
+        cached_translations = self.translation_cache.get_many(cache_keys.values())
+
+        to_be_translated = [
+            one_text for one_text in text if cache_keys[one_text] not in cached_translations
+        ]
+        if metrics is not None:
+            metrics.add(
+                "translation_cache_requests_total",
+                len(text) - len(to_be_translated),
+                result="hit",
+            )
+            metrics.add(
+                "translation_cache_requests_total", len(to_be_translated), result="miss"
+            )
+            metrics.add("translations_total", len(to_be_translated))
+        if self.inference_pool is not None and len(to_be_translated) > batch_size:
+            translations_list = self.inference_pool.translate(to_be_translated, batch_size)
+        else:
+            translations_list = self._translate_loc_to_english(to_be_translated, batch_size)
+        new_translations = dict(zip(to_be_translated, translations_list))
+        self.translation_cache.set_many(
+            {
+                cache_keys[one_text]: translation
+                for one_text, translation in new_translations.items()
+            }
+        )
 
-        translations = []
-        original_location_ids = [[] for _ in range(len(ner_results))]
-        original_location_languages = [[] for _ in range(len(ner_results))]
-        locations_count = 0
+        return {
+            one_text: new_translations[one_text]
+            if one_text in new_translations
+            else cached_translations[cache_keys[one_text]]
+            for one_text in text
+        }
+
+    def _get_locations_to_translate(
+        self,
+        locations: List[str],
+        countries: Optional[List[str]] = None,
+        metrics: Optional[ExtractionMetrics] = None,
+    ) -> List[str]:
+        """
+        Decide, for a whole batch of unique location names, which ones go to the MT model.
+        Cheap checks run first so that language detection only sees the ambiguous names:
+        - names that already exactly match a gazetteer name of the countries (of any
+        country if `countries` is None) are kept (the exact match on the original name
+        wins in the matching anyway),
+        - names containing non-Latin letters are always translated,
+        - the other names are translated if they are detected as non-English with
+        a probability of at least `min_language_probability`.
+        """
+        if countries is not None:
+            gazetteer_names, _ = self.gazetteer.get_feature_names_to_id(
+                _get_mapped_country_names(countries)
+            )
+        else:
+            gazetteer_names = self.gazetteer.get_global_names_index().names_entries
 
         to_be_translated = []
-        to_be_translated_ids = []
+        for one_location in locations:
+            decision = self._get_language_decision(one_location, gazetteer_names)
+            if metrics is not None:
+                metrics.add("language_decisions_total", decision=decision)
+            if decision in ["non_latin", "detected_non_en"]:
+                to_be_translated.append(one_location)
+
+        return to_be_translated
+
+    def _get_language_decision(
+        self, location: str, gazetteer_names: Dict[str, Any]
+    ) -> str:
+        if location in gazetteer_names:
+            return "gazetteer"
+
+        if not _is_latin_script(location):
+            return "non_latin"
+
+        try:
+            language = detect_langs(location)[0]
+        except LangDetectException:
+            # no letters to detect a language from: nothing to translate
+            return "undetected"
+
+        if language.lang != "en" and language.prob >= self.min_language_probability:
+            return "detected_non_en"
+        return "kept"
+
+    @torch.no_grad()
+    def _translate_location_groups(
+        self,
+        ner_results_groups: List[Tuple[List[List[Dict[str, str]]], Optional[List[str]]]],
+        batch_size: Optional[int] = None,
+        metrics: Optional[ExtractionMetrics] = None,
+    ):
+        """
+        Add `translated_to_en` to the locations of groups of texts, each group with
+        its countries. Which names to translate is decided per group (names of the
+        gazetteer of its countries are kept), then the names of all the groups are
+        translated in one pass.
+        """
+        if metrics is None:
+            metrics = ExtractionMetrics()
 
-        for i, original_locations in enumerate(ner_results):
-            for j, one_location in enumerate(original_locations):
-                try:
-                    language = detect(one_location["original"])
-                except:
-                    language = "-"
-                original_location_languages[i].append(language)
-                original_location_ids[i].append(locations_count)
+        to_be_translated_groups = []
+        with metrics.time_stage("language_detection"):
+            for ner_results, countries in ner_results_groups:
+                # the same places are mentioned many times: detect and translate each name once
+                unique_locations = list(
+                    dict.fromkeys(
+                        one_location["original"]
+                        for original_locations in ner_results
+                        for one_location in original_locations
+                        if "latitude" not in one_location
+                    )
+                )
+                to_be_translated_groups.append(
+                    set(self._get_locations_to_translate(unique_locations, countries, metrics))
+                )
+
+        with metrics.time_stage("translation"):
+            translations = self._translate_with_cache(
+                list(
+                    dict.fromkeys(
+                        one_location
+                        for to_be_translated in to_be_translated_groups
+                        for one_location in to_be_translated
+                    )
+                ),
+                batch_size,
+                metrics,
+            )
 
-                if language != "en":
-                    to_be_translated.append(one_location["original"])
-                    to_be_translated_ids.append(locations_count)
+        # names that are not translated (english, or gazetteer names) are kept as they are
+        for (ner_results, _), to_be_translated in zip(ner_results_groups, to_be_translated_groups):
+            for original_locations in ner_results:
+                for one_location in original_locations:
+                    one_location["translated_to_en"] = (
+                        translations[one_location["original"]]
+                        if one_location["original"] in to_be_translated
+                        else one_location["original"]
+                    )
 
-                locations_count += 1
+    def _add_translations(
+        self,
+        ner_results: List[List[Dict[str, str]]],
+        countries: Optional[List[str]] = None,
+        metrics: Optional[ExtractionMetrics] = None,
+    ):
+        if self.do_translation:
+            self._translate_location_groups([(ner_results, countries)], metrics=metrics)
+        return ner_results
 
-        translations_list: List[str] = self._translate_loc_to_english(
-            to_be_translated, batch_size
+    def _match_locations(
+        self,
+        ner_results: List[List[Dict[str, str]]],
+        countries: Optional[List[str]],
+        metrics: ExtractionMetrics,
+        country_priors: Optional[Dict[str, float]] = None,
+    ) -> List[Dict[str, Dict[int, Dict[str, str]]]]:
+        with metrics.time_stage("matching"):
+            matched_locations = _match_locations_to_maps_data(
+                [
+                    [loc for loc in text_locations if "latitude" not in loc]
+                    for text_locations in ner_results
+                ],
+                countries,
+                gazetteer=self.gazetteer,
+                n_workers=self.matching_workers,
+                metrics=metrics,
+                country_priors=country_priors,
+            )
+            if self.reverse_geocoder is not None:
+                self._add_coordinates_locations(
+                    ner_results, matched_locations, countries, metrics
+                )
+        return matched_locations
+
+    def _aggregate_outputs(
+        self,
+        ner_results: List[List[Dict[str, str]]],
+        matched_locations: List[Dict[str, Dict[int, Dict[str, str]]]],
+        metrics: ExtractionMetrics,
+        output_format: str = "nested",
+    ) -> Union[Dict[str, List[Any]], Any]:
+        with metrics.time_stage("aggregation"):
+            if output_format == "nested":
+                return _get_outputs(ner_results, matched_locations)
+            table = _get_columnar_outputs(ner_results, matched_locations)
+            return table if output_format == "arrow" else table.to_pandas()
+
+    def _add_coordinates_locations(
+        self,
+        ner_results: List[List[Dict[str, Any]]],
+        matched_locations: List[Dict[str, Dict[int, Dict[str, str]]]],
+        countries: Optional[List[str]],
+        metrics: ExtractionMetrics,
+    ):
+        """
+        Resolve the coordinates mentions of all the texts with one spatial index query.
+        """
+        coordinates_mentions = [
+            (text_id, loc)
+            for text_id, text_locations in enumerate(ner_results)
+            for loc in text_locations
+            if "latitude" in loc
+        ]
+        locations_hierarchies = self.reverse_geocoder.get_locations_hierarchies(
+            [(loc["latitude"], loc["longitude"]) for _, loc in coordinates_mentions],
+            _get_mapped_country_names(countries) if countries is not None else None,
         )
+        for (text_id, loc), location_hierarchy in zip(
+            coordinates_mentions, locations_hierarchies
+        ):
+            matched_locations[text_id][loc["original"]] = location_hierarchy
+            metrics.add(
+                "matches_total",
+                kind="coordinates" if len(location_hierarchy) > 0 else "none",
+            )
+
+    def __call__(
+        self,
+        text: List[str],
+        countries: Optional[List[str]] = None,
+        output_format: str = "nested",
+        country_priors: Optional[Dict[str, float]] = None,
+    ) -> Union[Dict[str, List[Any]], Any]:
+        """
+        Without `countries`, the locations are matched against all the countries of
+        the gazetteer. `country_priors` (weights in [0, 1] by country, 0.5 for the
+        countries left out) then rank the places sharing a name or matching as well.
 
-        # after doing the translations, i need to return a list of lists
-        # where each sublist contains the translations for the locations if they are not english
-        # or the locations themselve if they are english
-
-        translated_locations = []
-        locations_index = 0
-        for i, original_locations in enumerate(ner_results):
-            translated_sublist = []
-            for j, one_location in enumerate(original_locations):
-                if original_location_languages[i][j] == "en":
-                    final_translation = one_location["original"]
-                else:
-                    final_translation = translations_list[locations_index]
-                    locations_index += 1
-                
-                translated_sublist.append(final_translation)
-            translated_locations.append(translated_sublist)
-
-        return translated_locations
-
-    def __call__(self, text: List[str], countries: List[str]) -> Dict[str, List[Any]]:
+        `output_format="nested"` returns the dict of nested lists described in the README.
+        `"arrow"` returns a `pyarrow.Table` with one row per (document, mention,
+        admin level) and dictionary-encoded strings, `"pandas"` the same as a
+        DataFrame with categorical columns.
+        """
+        _check_output_format(output_format)
         # process all entries with batches
+        call_metrics = ExtractionMetrics()
 
-        ner_results: List[Dict[str, str]] = self.extract_locations(text)
+        if self.document_cache is not None:
+            ner_results, matched_locations = self._process_with_document_cache(
+                text, countries, call_metrics, country_priors
+            )
+        else:
+            ner_results, matched_locations = self._process_documents(
+                text, countries, call_metrics, country_priors
+            )
 
-        if self.do_translation:
-            translations: List[List[str]] = self._do_translations(ner_results)
-            for i, one_entry_translations in enumerate(translations):
-                for j, one_translation in enumerate(one_entry_translations):
-                    ner_results[i][j]["translated_to_en"] = one_translation
+        outputs = self._aggregate_outputs(
+            ner_results, matched_locations, call_metrics, output_format
+        )
 
-        matched_locations = _match_locations_to_maps_data(ner_results, countries)
+        self._report_metrics(call_metrics)
+        return outputs
 
-        outputs = {
-            "geolocations": ner_results,
-            "geolocation_by_admin_level": matched_locations,
-        }
+    def _process_documents(
+        self,
+        text: List[str],
+        countries: Optional[List[str]],
+        metrics: ExtractionMetrics,
+        country_priors: Optional[Dict[str, float]] = None,
+    ) -> Tuple[List[List[Dict[str, str]]], List[Dict[str, Dict[int, Dict[str, str]]]]]:
+        ner_results: List[Dict[str, str]] = self.extract_locations(text, metrics=metrics)
+        ner_results = self._add_translations(ner_results, countries, metrics)
+        matched_locations = self._match_locations(
+            ner_results, countries, metrics, country_priors
+        )
+        return ner_results, matched_locations
 
-        for admin_lvl in range(5):
-            adm_n_locations = [
-                _get_adm_n_locations(matched_locations_one_entry, admin_lvl)
-                for matched_locations_one_entry in matched_locations
+    def _get_document_cache_key(
+        self,
+        one_text: str,
+        countries: Optional[List[str]],
+        country_priors: Optional[Dict[str, float]],
+    ) -> str:
+        """
+        Hash of the normalized text and of everything its outputs depend on: the
+        country set, the models, the NER windows settings and the gazetteer (and
+        polygons) file versions.
+        """
+        settings = [
+            _normalize_document(one_text),
+            sorted(set(countries)) if countries is not None else None,
+            sorted(country_priors.items()) if country_priors is not None else None,
+            self.ner_model_name,
+            self.backend,
+            self._get_translation_settings() if self.do_translation else None,
+            self.min_language_probability,
+            self.split_long_texts,
+            self.ner_window_tokens,
+            self.ner_window_overlap,
+            str(self.gazetteer.feature_names_to_id_path),
+            self.gazetteer._get_file_version(),
+        ]
+        if self.reverse_geocoder is not None:
+            polygons_index_path = self.reverse_geocoder.polygons_index_path
+            settings += [
+                str(polygons_index_path),
+                os.path.getmtime(polygons_index_path)
+                if os.path.exists(polygons_index_path)
+                else None,
             ]
-            outputs[f"location_by_adm_level_{admin_lvl}"] = adm_n_locations
+        return hashlib.sha256(
+            json.dumps(settings, ensure_ascii=False).encode("utf-8")
+        ).hexdigest()
 
-        return outputs
+    def _get_cached_documents(
+        self,
+        text: List[str],
+        countries: Optional[List[str]],
+        metrics: ExtractionMetrics,
+        country_priors: Optional[Dict[str, float]] = None,
+    ) -> Tuple[List[str], Dict[str, Any], Dict[str, str]]:
+        """
+        Cache keys of the texts, stored outputs of the documents already processed,
+        and the distinct remaining texts by cache key.
+        """
+        cache_keys = [
+            self._get_document_cache_key(one_text, countries, country_priors)
+            for one_text in text
+        ]
+        cached_documents = self.document_cache.get_many(cache_keys)
+        # duplicates of the same call are processed once as well
+        missing_texts = {
+            cache_key: one_text
+            for cache_key, one_text in zip(cache_keys, text)
+            if cache_key not in cached_documents
+        }
+        metrics.add(
+            "document_cache_requests_total",
+            len(text) - len(missing_texts),
+            result="hit",
+        )
+        metrics.add("document_cache_requests_total", len(missing_texts), result="miss")
+        return cache_keys, cached_documents, missing_texts
+
+    def _get_documents_outputs(
+        self,
+        cache_keys: List[str],
+        cached_documents: Dict[str, Any],
+        missing_texts: Dict[str, str],
+        ner_results: List[List[Dict[str, str]]],
+        matched_locations: List[Dict[str, Dict[int, Dict[str, str]]]],
+    ) -> Tuple[List[List[Dict[str, str]]], List[Dict[str, Dict[int, Dict[str, str]]]]]:
+        """
+        Store the outputs of the `missing_texts`, and return the outputs of every text.
+        """
+        if len(missing_texts) > 0:
+            new_documents = dict(zip(missing_texts, zip(ner_results, matched_locations)))
+            self.document_cache.set_many(new_documents)
+            cached_documents.update(new_documents)
+
+        ner_results, matched_locations = [], []
+        for cache_key in cache_keys:
+            # the callers may modify the outputs: each document gets its own copy
+            one_text_locations, one_text_matches = copy.deepcopy(cached_documents[cache_key])
+            ner_results.append(one_text_locations)
+            matched_locations.append(one_text_matches)
+        return ner_results, matched_locations
+
+    def _process_with_document_cache(
+        self,
+        text: List[str],
+        countries: Optional[List[str]],
+        metrics: ExtractionMetrics,
+        country_priors: Optional[Dict[str, float]] = None,
+    ) -> Tuple[List[List[Dict[str, str]]], List[Dict[str, Dict[int, Dict[str, str]]]]]:
+        """
+        Reuse the stored outputs of the documents already processed, run the models
+        once per distinct remaining document and store its outputs.
+        """
+        cache_keys, cached_documents, missing_texts = self._get_cached_documents(
+            text, countries, metrics, country_priors
+        )
+        ner_results, matched_locations = [], []
+        if len(missing_texts) > 0:
+            ner_results, matched_locations = self._process_documents(
+                list(missing_texts.values()), countries, metrics, country_priors
+            )
+        return self._get_documents_outputs(
+            cache_keys, cached_documents, missing_texts, ner_results, matched_locations
+        )
+
+    def stream(
+        self,
+        text: Iterable[str],
+        countries: Optional[List[str]] = None,
+        chunk_size: int = 32,
+        max_queued_chunks: int = 2,
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Streaming version of `__call__` for large or unbounded inputs.
+
+        `text` is consumed lazily in chunks of `chunk_size` texts and one output per
+        document is yielded, in input order, with the same keys as `__call__`
+        (e.g. `geolocations` holds the locations of that document only).
+        NER and translation run in background threads and matching runs in the
+        caller's thread, so the three stages work on consecutive chunks at the
+        same time. At most `max_queued_chunks` chunks wait between two stages.
+        Metrics are reported once per chunk. With a document cache, only the
+        documents of a chunk missing from the cache go through the stages.
+        """
+
+        def _extract_chunk(
+            chunk: List[str],
+        ) -> Tuple[List[List[Dict[str, str]]], ExtractionMetrics, Optional[Tuple]]:
+            chunk_metrics = ExtractionMetrics()
+            document_cache_lookup = None
+            if self.document_cache is not None:
+                document_cache_lookup = self._get_cached_documents(
+                    chunk, countries, chunk_metrics
+                )
+                chunk = list(document_cache_lookup[2].values())
+            ner_results = (
+                self.extract_locations(chunk, metrics=chunk_metrics) if len(chunk) > 0 else []
+            )
+            return ner_results, chunk_metrics, document_cache_lookup
+
+        def _translate_chunk(
+            chunk: Tuple[List[List[Dict[str, str]]], ExtractionMetrics, Optional[Tuple]],
+        ) -> Tuple[List[List[Dict[str, str]]], ExtractionMetrics, Optional[Tuple]]:
+            ner_results, chunk_metrics, document_cache_lookup = chunk
+            return (
+                self._add_translations(ner_results, countries, chunk_metrics),
+                chunk_metrics,
+                document_cache_lookup,
+            )
+
+        def _match_chunk(
+            chunk: Tuple[List[List[Dict[str, str]]], ExtractionMetrics, Optional[Tuple]],
+        ) -> Dict[str, List[Any]]:
+            ner_results, chunk_metrics, document_cache_lookup = chunk
+            matched_locations = (
+                self._match_locations(ner_results, countries, chunk_metrics)
+                if len(ner_results) > 0
+                else []
+            )
+            if document_cache_lookup is not None:
+                ner_results, matched_locations = self._get_documents_outputs(
+                    *document_cache_lookup, ner_results, matched_locations
+                )
+            chunk_outputs = self._aggregate_outputs(
+                ner_results, matched_locations, chunk_metrics
+            )
+            self._report_metrics(chunk_metrics)
+            return chunk_outputs
+
+        for chunk_outputs in _run_pipeline(
+            _iter_chunks(text, chunk_size),
+            [_extract_chunk, _translate_chunk, _match_chunk],
+            max_queued_items=max_queued_chunks,
+        ):
+            for i in range(len(chunk_outputs["geolocations"])):
+                yield {key: values[i] for key, values in chunk_outputs.items()}
+
+
+def get_geolocation_extractor(
+    model_name: str = os.getenv(
+        "NER_MODEL_NAME", "dbmdz/bert-large-cased-finetuned-conll03-english"
+    ),
+    translate_to_english: bool = True,
+    mt_to_en_model: str = os.getenv(
+        "MT_TO_EN_MODEL_NAME", "Helsinki-NLP/opus-mt-mul-en"
+    ),
+    device: Optional[str] = None,
+    backend: str = os.getenv("INFERENCE_BACKEND", "torch"),
+) -> GeolocationExtractor:
+    """
+    Return the process-wide extractor for these settings, creating it on the first call.
+    The translation model is only loaded once some location needs translation.
+    """
+    if device is None:
+        device = _get_device()
+
+    return get_cached(
+        ("extractor", model_name, translate_to_english, mt_to_en_model, device, backend),
+        lambda: GeolocationExtractor(
+            model_name=model_name,
+            translate_to_english=translate_to_english,
+            mt_to_en_model=mt_to_en_model,
+            device=device,
+            lazy_translation_model=True,
+            backend=backend,
+        ),
+    )
@@ -1,7 +1,16 @@
 import os
-from typing import List, Dict, Set, Any
+import gc
+import multiprocessing
+from typing import Callable, List, Dict, Set, Any, Optional, Tuple
 from fuzzywuzzy import fuzz
-import json
+from src.gazetteer import (
+    Gazetteer,
+    _AdminHierarchy,
+    _GeoNamesMatchIndex,
+    _GlobalNamesIndex,
+    _LRUCache,
+)
+from src.metrics import ExtractionMetrics
 
 
 countries_mapping = {
@@ -34,19 +43,44 @@ def _flatten_lists(list_of_lists: List[List[Any]]) -> List[Any]:
     return [item for sublist in list_of_lists for item in sublist]
 
 
+def _get_mapped_country_names(treated_country_names: List[str]) -> List[str]:
+    return list(
+        set(
+            _flatten_lists(
+                [
+                    _map_offcial_name_to_mapped_name(country_name)
+                    for country_name in treated_country_names
+                ]
+            )
+        )
+    )
+
+
 def _find_matches(
     input_terms: List[str],
     geo_names: List[str],
     similaritty_threshold=95,
     length_threshold=0.7,
+    match_index: Optional[_GeoNamesMatchIndex] = None,
+    metrics: Optional[ExtractionMetrics] = None,
 ) -> List[Dict[str, int]]:
     """
     Find matches for one term
+
+    If `match_index` is given, candidates are pruned with the prebuilt n-gram index,
+    otherwise all the `geo_names` are scanned.
     """
 
+    if match_index is not None:
+        return match_index.find_matches(
+            input_terms, similaritty_threshold, length_threshold, metrics=metrics
+        )
+
     # Try exact match
     for one_inpt_term in input_terms:
         if one_inpt_term in geo_names:
+            if metrics is not None:
+                metrics.add("matches_total", kind="exact")
             return [one_inpt_term]
 
     matches = []
@@ -65,6 +99,10 @@ def _find_matches(
                 
     #TODO: add AI-based matching
 
+    if metrics is not None:
+        metrics.add("fuzzy_comparisons_total", len(input_terms) * len(geo_names))
+        metrics.add("matches_total", kind="fuzzy" if len(matches) > 0 else "none")
+
     # keep matches with the highest score
     matches = sorted(matches, key=lambda x: x["score"], reverse=True)
     matches = [matches[0]["match"]] if len(matches) > 0 else []
@@ -86,59 +124,237 @@ def _find_matches(
 #     return available_countries_list
 
 
-def _get_final_location_ids(
-    extracted_geolocation: List[List[str]],
-    feature_names_to_id: Dict[str, Dict[str, Dict[str, str]]],
-) -> List[Dict[str, Dict[str, Dict[str, str]]]]:
+def _get_location_hierarchy(
+    input_terms: List[str],
+    hierarchy: _AdminHierarchy,
+    match_index: _GeoNamesMatchIndex,
+    metrics: Optional[ExtractionMetrics] = None,
+) -> Dict[int, Dict[str, str]]:
+    """
+    Match the terms of one location and return its `{admin_level: {id, name, Pcode}}`.
+    """
+
+    matched_locations = _find_matches(
+        input_terms, match_index.geo_names, match_index=match_index, metrics=metrics
+    )
+
+    if len(matched_locations) == 0:
+        return {}
+
+    one_loc = matched_locations[0]  # only one location is there
+
+    return hierarchy.get_location_hierarchy(one_loc)
 
+
+def _resolve_location_ids(
+    extracted_geolocation: List[List[Dict[str, str]]],
+    get_location_hierarchy: Callable[[List[str]], Dict[int, Dict[str, str]]],
+    matches_cache: Optional[_LRUCache] = None,
+    metrics: Optional[ExtractionMetrics] = None,
+    cache_key: Tuple = (),
+    new_matches: Optional[Dict[Tuple, Dict[int, Dict[str, str]]]] = None,
+) -> List[Dict[str, Dict[str, Dict[str, str]]]]:
+    """
+    Terms resolved here (not found in `matches_cache`) are also added to `new_matches`.
+    """
     final_locations = []
     for geolocations_one_extract in extracted_geolocation:
         matched_locations_one_extract = {}
         for locs in geolocations_one_extract:
             # locs contains original location and translated loc
+            # (a translation equal to the original does not change the match)
+            input_terms = tuple(dict.fromkeys(locs.values()))
+
+            final_locations_one_loc = None
+            if matches_cache is not None:
+                final_locations_one_loc = matches_cache.get(input_terms + cache_key)
+                if final_locations_one_loc is not None and metrics is not None:
+                    metrics.add("matches_total", kind="cached")
+
+            if final_locations_one_loc is None:
+                final_locations_one_loc = get_location_hierarchy(list(input_terms))
+                if matches_cache is not None:
+                    matches_cache.put(input_terms + cache_key, final_locations_one_loc)
+                if new_matches is not None:
+                    new_matches[input_terms + cache_key] = final_locations_one_loc
+
+            # copy so that callers modifying the outputs do not alter the cache
+            matched_locations_one_extract[locs["original"]] = {
+                admin_level: dict(loc_props)
+                for admin_level, loc_props in final_locations_one_loc.items()
+            }
+        final_locations.append(matched_locations_one_extract)
+
+    return final_locations
 
-            matched_locations = _find_matches(
-                list(locs.values()), list(feature_names_to_id.keys())
-            )
 
-            if len(matched_locations) == 0:
-                final_locations_one_loc = {}
+def _get_final_location_ids(
+    extracted_geolocation: List[List[str]],
+    feature_names_to_id: Dict[str, Dict[str, Dict[str, str]]],
+    match_index: Optional[_GeoNamesMatchIndex] = None,
+    matches_cache: Optional[_LRUCache] = None,
+    metrics: Optional[ExtractionMetrics] = None,
+    hierarchy: Optional[_AdminHierarchy] = None,
+    new_matches: Optional[Dict[Tuple, Dict[int, Dict[str, str]]]] = None,
+) -> List[Dict[str, Dict[str, Dict[str, str]]]]:
+    """
+    If `matches_cache` is given, the hierarchy of terms already resolved for the
+    same country set is reused instead of running the fuzzy matching again.
+    """
 
-            else:
-                one_loc = matched_locations[0]  # only one location is there
+    if match_index is None:
+        match_index = _GeoNamesMatchIndex(list(feature_names_to_id.keys()))
+    if hierarchy is None:
+        hierarchy = _AdminHierarchy(feature_names_to_id)
+
+    return _resolve_location_ids(
+        extracted_geolocation,
+        lambda input_terms: _get_location_hierarchy(
+            input_terms, hierarchy, match_index, metrics
+        ),
+        matches_cache=matches_cache,
+        metrics=metrics,
+        new_matches=new_matches,
+    )
 
-                final_locations_one_loc = {}
 
-                # try:
-                # print(feature_names_to_id[one_loc])
-                extracted_location = {
-                    "id": feature_names_to_id[one_loc]["id"],
-                    "name": one_loc,
-                    "Pcode": feature_names_to_id[one_loc]["Pcode"],
-                }
+def _get_final_location_ids_global(
+    extracted_geolocation: List[List[Dict[str, str]]],
+    global_index: _GlobalNamesIndex,
+    matches_cache: Optional[_LRUCache] = None,
+    metrics: Optional[ExtractionMetrics] = None,
+    country_priors: Optional[Dict[str, float]] = None,
+) -> List[Dict[str, Dict[str, Dict[str, str]]]]:
+    """
+    Match the locations against the names of all the countries, keeping the
+    best ranked (country, node) candidate of each location.
+    """
 
-                final_locations_one_loc[feature_names_to_id[one_loc]["admin_level"]] = (
-                    extracted_location
-                )
+    def _get_global_location_hierarchy(input_terms: List[str]) -> Dict[int, Dict[str, str]]:
+        candidates = global_index.find_candidates(
+            input_terms, country_priors, max_candidates=1, metrics=metrics
+        )
+        if len(candidates) == 0:
+            return {}
+        country_name, _, geo_name, _ = candidates[0]
+        return global_index.get_location_hierarchy(country_name, geo_name)
+
+    # the same terms can resolve differently with other priors
+    cache_key = tuple(sorted(country_priors.items())) if country_priors is not None else ()
+    return _resolve_location_ids(
+        extracted_geolocation,
+        _get_global_location_hierarchy,
+        matches_cache=matches_cache,
+        metrics=metrics,
+        cache_key=(cache_key,),
+    )
 
-                parent_locations = feature_names_to_id[one_loc]["parent_locations"]
-                for parent_loc_id, one_parent_properties in parent_locations.items():
 
-                    admin_level = int(parent_loc_id.split(" ")[1])
+# set in each matching worker by its initializer: with `fork` the arguments are
+# inherited through copy-on-write memory instead of being pickled
+_shared_matching_data: Optional[
+    Tuple[
+        Dict[str, Dict[str, Dict[str, str]]],
+        _GeoNamesMatchIndex,
+        Optional[_LRUCache],
+        _AdminHierarchy,
+    ]
+] = None
+
+
+def _init_matching_worker(
+    shared_matching_data: Tuple[
+        Dict[str, Dict[str, Dict[str, str]]],
+        _GeoNamesMatchIndex,
+        Optional[_LRUCache],
+        _AdminHierarchy,
+    ],
+) -> None:
+    global _shared_matching_data
+    _shared_matching_data = shared_matching_data
+
+
+def _match_documents_shard(
+    extracted_geolocation: List[List[Dict[str, str]]],
+) -> Tuple[
+    List[Dict[str, Dict[str, Dict[str, str]]]],
+    ExtractionMetrics,
+    Dict[Tuple, Dict[int, Dict[str, str]]],
+]:
+    feature_names_to_id, match_index, matches_cache, hierarchy = _shared_matching_data
+    shard_metrics = ExtractionMetrics()
+    # the puts of a worker land in its copy-on-write copy of the cache:
+    # the new matches are sent back to be cached by the parent
+    new_matches = {}
+    shard_locations = _get_final_location_ids(
+        extracted_geolocation,
+        feature_names_to_id,
+        match_index=match_index,
+        matches_cache=matches_cache,
+        metrics=shard_metrics,
+        hierarchy=hierarchy,
+        new_matches=new_matches,
+    )
+    return shard_locations, shard_metrics, new_matches
 
-                    loc_name = one_parent_properties["name"]
-                    loc_props = {
-                        "id": feature_names_to_id[loc_name]["id"],
-                        "name": loc_name,
-                        "Pcode": feature_names_to_id[loc_name]["Pcode"],
-                    }
 
-                    final_locations_one_loc[admin_level] = loc_props
+def _get_final_location_ids_parallel(
+    extracted_geolocation: List[List[Dict[str, str]]],
+    feature_names_to_id: Dict[str, Dict[str, Dict[str, str]]],
+    match_index: _GeoNamesMatchIndex,
+    matches_cache: Optional[_LRUCache] = None,
+    n_workers: int = 1,
+    metrics: Optional[ExtractionMetrics] = None,
+    hierarchy: Optional[_AdminHierarchy] = None,
+) -> List[Dict[str, Dict[str, Dict[str, str]]]]:
+    """
+    Same as `_get_final_location_ids`, with the documents sharded across `n_workers`
+    forked processes. Falls back to one process where `fork` is not available.
+    """
+    if hierarchy is None:
+        hierarchy = _AdminHierarchy(feature_names_to_id)
+
+    if (
+        n_workers <= 1
+        or len(extracted_geolocation) < 2
+        or "fork" not in multiprocessing.get_all_start_methods()
+    ):
+        return _get_final_location_ids(
+            extracted_geolocation,
+            feature_names_to_id,
+            match_index=match_index,
+            matches_cache=matches_cache,
+            metrics=metrics,
+            hierarchy=hierarchy,
+        )
 
-            matched_locations_one_extract[locs["original"]] = final_locations_one_loc
-        final_locations.append(matched_locations_one_extract)
+    n_workers = min(n_workers, len(extracted_geolocation))
+    shard_size = -(-len(extracted_geolocation) // n_workers)
+    shards = [
+        extracted_geolocation[i : i + shard_size]
+        for i in range(0, len(extracted_geolocation), shard_size)
+    ]
 
-    return final_locations
+    shared_matching_data = (feature_names_to_id, match_index, matches_cache, hierarchy)
+    # keep the gc of the workers from touching (and so copying) the shared objects
+    gc.freeze()
+    try:
+        with multiprocessing.get_context("fork").Pool(
+            n_workers,
+            initializer=_init_matching_worker,
+            initargs=(shared_matching_data,),
+        ) as pool:
+            shards_outputs = pool.map(_match_documents_shard, shards)
+    finally:
+        gc.unfreeze()
+
+    for _, shard_metrics, new_matches in shards_outputs:
+        if metrics is not None:
+            metrics.merge(shard_metrics)
+        if matches_cache is not None:
+            for input_terms, location_hierarchy in new_matches.items():
+                matches_cache.put(input_terms, location_hierarchy)
+    return _flatten_lists([shard_locations for shard_locations, _, _ in shards_outputs])
 
 
 def _get_geolocations_by_admin_level(
@@ -167,35 +383,55 @@ def _get_geolocations_by_admin_level(
 
 def _match_locations_to_maps_data(
     extracted_geolocations: List[List[Dict[str, str]]],
-    treated_country_names: List[str],
+    treated_country_names: Optional[List[str]],
     feature_names_to_id: os.PathLike = os.path.join("data", "feature_name_to_id.json"),
+    gazetteer: Optional[Gazetteer] = None,
+    n_workers: int = 1,
+    metrics: Optional[ExtractionMetrics] = None,
+    country_priors: Optional[Dict[str, float]] = None,
 ) -> Dict[str, List[Any]]:
+    """
+    With `treated_country_names=None`, the locations are matched against all the
+    countries through the global names index, optionally weighted by `country_priors`.
+    """
 
-    # if not os.path.exists(saved_geolocations_data_folder):
-    mapped_country_names = list(
-        set(
-            _flatten_lists(
-                [
-                    _map_offcial_name_to_mapped_name(country_name)
-                    for country_name in treated_country_names
-                ]
-            )
+    if gazetteer is None:
+        gazetteer = Gazetteer(feature_names_to_id)
+
+    if treated_country_names is None:
+        if country_priors is not None:
+            country_priors = {
+                mapped_country_name: prior
+                for country_name, prior in country_priors.items()
+                for mapped_country_name in _map_offcial_name_to_mapped_name(country_name)
+            }
+        return _get_final_location_ids_global(
+            extracted_geolocations,
+            gazetteer.get_global_names_index(),
+            matches_cache=gazetteer.get_global_matches_cache(),
+            metrics=metrics,
+            country_priors=country_priors,
         )
-    )
 
-    with open(feature_names_to_id, "r") as f:
-        feature_names_to_id = json.load(f)
+    # if not os.path.exists(saved_geolocations_data_folder):
+    mapped_country_names = _get_mapped_country_names(treated_country_names)
 
-    country_specific_feature_names_to_id = {}
-    for country_name in mapped_country_names:
-        if country_name not in feature_names_to_id:
-            print(f"Country {country_name} not found in feature_names_to_id")
-            continue
-        country_specific_feature_names_to_id.update(feature_names_to_id[country_name])
+    country_specific_feature_names_to_id, match_index = (
+        gazetteer.get_feature_names_to_id(mapped_country_names)
+    )
+    if metrics is not None:
+        # their locations cannot be matched: counted on every call
+        for country_name in gazetteer.get_missing_countries(mapped_country_names):
+            metrics.add("missing_countries_total", country=country_name)
 
-    matched_locations = _get_final_location_ids(
+    matched_locations = _get_final_location_ids_parallel(
         extracted_geolocations,
         country_specific_feature_names_to_id,
+        match_index=match_index,
+        matches_cache=gazetteer.get_matches_cache(mapped_country_names),
+        n_workers=n_workers,
+        metrics=metrics,
+        hierarchy=gazetteer.get_admin_hierarchy(mapped_country_names),
     )
 
     return matched_locations
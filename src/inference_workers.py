@@ -0,0 +1,149 @@
+import gc
+import multiprocessing
+import os
+import threading
+from typing import Dict, List, Optional, Tuple, Union
+
+import torch
+
+
+# set in each worker by its initializer: with `fork` the extractor is inherited
+# through copy-on-write memory instead of being pickled or loaded again
+_shared_extractor = None
+
+
+def _init_inference_worker(extractor, n_threads: int):
+    global _shared_extractor
+    _shared_extractor = extractor
+    torch.set_num_threads(n_threads)
+
+
+def _extract_locations_shard(
+    shard: Tuple[List[str], int, Optional[int]],
+) -> List[List[Dict[str, str]]]:
+    text, batch_size, max_batch_tokens = shard
+    return _shared_extractor._extract_locations(text, batch_size, max_batch_tokens)
+
+
+def _translate_shard(shard: Tuple[List[str], int]) -> List[str]:
+    text, batch_size = shard
+    return _shared_extractor._translate_loc_to_english(text, batch_size)
+
+
+def _get_memory_usage(pid: Union[int, str] = "self") -> Dict[str, float]:
+    """
+    RSS, PSS (shared pages divided among the processes sharing them) and private
+    memory of a process, in MB. Linux only.
+    """
+    values = {}
+    with open(f"/proc/{pid}/smaps_rollup", "r") as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) == 3 and fields[2] == "kB":
+                values[fields[0].rstrip(":")] = int(fields[1]) / 1024
+    return {
+        "rss_mb": values["Rss"],
+        "pss_mb": values["Pss"],
+        "private_mb": values["Private_Clean"] + values["Private_Dirty"],
+    }
+
+
+def _split_in_shards(text: List[str], shard_size: int, n_workers: int) -> List[List[str]]:
+    # small calls are spread over all the workers too
+    shard_size = max(1, min(shard_size, -(-len(text) // n_workers)))
+    return [text[i : i + shard_size] for i in range(0, len(text), shard_size)]
+
+
+class InferenceWorkers:
+    """
+    Forked CPU processes running the NER and MT models of a `GeolocationExtractor`.
+
+    The models are loaded once in the parent before forking, and the workers read
+    the weights through copy-on-write memory: N workers do not hold N copies of
+    BERT-large and Marian. Each worker runs `threads_per_worker` intra-op threads
+    (the CPUs divided among the workers by default). Texts are sent in shards of
+    `shard_size` texts to the first idle worker, and results keep the input order.
+    """
+
+    def __init__(
+        self,
+        extractor,
+        n_workers: int,
+        threads_per_worker: Optional[int] = None,
+        shard_size: int = 16,
+    ):
+        if extractor.device != "cpu" or extractor.backend == "onnx":
+            raise ValueError(
+                "Inference workers run the torch backends on cpu, "
+                f"not {extractor.backend} on {extractor.device}"
+            )
+        if "fork" not in multiprocessing.get_all_start_methods():
+            raise ValueError("Inference workers need the fork start method")
+
+        self.extractor = extractor
+        self.n_workers = n_workers
+        self.threads_per_worker = (
+            threads_per_worker
+            if threads_per_worker is not None
+            else max(1, (os.cpu_count() or 1) // n_workers)
+        )
+        self.shard_size = shard_size
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._pool is not None:
+                return
+            if self.extractor.do_translation:
+                # shared with the workers instead of being loaded by each of them
+                self.extractor._load_translation_model()
+
+            # keep the gc of the workers from touching (and so copying) the shared objects
+            gc.freeze()
+            try:
+                # the pool keeps the initargs, so replacement workers get the extractor too
+                self._pool = multiprocessing.get_context("fork").Pool(
+                    self.n_workers,
+                    initializer=_init_inference_worker,
+                    initargs=(self.extractor, self.threads_per_worker),
+                )
+            finally:
+                gc.unfreeze()
+
+    def close(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.terminate()
+                self._pool.join()
+                self._pool = None
+
+    def extract_locations(
+        self, text: List[str], batch_size: int, max_batch_tokens: Optional[int]
+    ) -> List[List[Dict[str, str]]]:
+        self.start()
+        shards_results = self._pool.map(
+            _extract_locations_shard,
+            [
+                (shard, batch_size, max_batch_tokens)
+                for shard in _split_in_shards(text, self.shard_size, self.n_workers)
+            ],
+            chunksize=1,
+        )
+        return [one_text_locations for shard in shards_results for one_text_locations in shard]
+
+    def translate(self, text: List[str], batch_size: int) -> List[str]:
+        self.start()
+        shards_results = self._pool.map(
+            _translate_shard,
+            [(shard, batch_size) for shard in _split_in_shards(text, self.shard_size, self.n_workers)],
+            chunksize=1,
+        )
+        return [translation for shard in shards_results for translation in shard]
+
+    def get_memory_usage(self) -> List[Dict[str, float]]:
+        """
+        `_get_memory_usage` of each worker process.
+        """
+        self.start()
+        return [_get_memory_usage(process.pid) for process in self._pool._pool]
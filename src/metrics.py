@@ -0,0 +1,102 @@
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict, Iterator, Tuple
+
+
+# name -> help text of the metrics, in the order of the prometheus dump
+_METRICS_HELP = {
+    "documents_total": "Documents processed.",
+    "entities_total": "Location entities extracted by the NER model.",
+    "stage_seconds_total": "Wall time spent in each stage.",
+    "language_decisions_total": "Unique location names by translation decision.",
+    "translations_total": "Location names translated by the MT model.",
+    "translation_cache_requests_total": "Translation cache lookups by result.",
+    "document_cache_requests_total": "Document cache lookups by result.",
+    "missing_countries_total": "Calls requesting a country missing from the gazetteer, by country.",
+    "matches_total": "Matched locations by kind (exact, fuzzy, none, cached, coordinates).",
+    "fuzzy_comparisons_total": "Fuzzy similarity scores computed in _find_matches.",
+    "service_requests_total": "Requests served by GeolocationService.",
+    "service_batches_total": "Batches run by GeolocationService.",
+}
+
+
+class ExtractionMetrics:
+    """
+    Thread-safe counters of one or several extraction calls.
+
+    Counters have a name and optional labels, e.g.
+    `metrics.add("matches_total", kind="exact")`.
+    """
+
+    def __init__(self):
+        self.counters: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = (
+            defaultdict(float)
+        )
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # sent back from the matching worker processes
+        return {"counters": dict(self.counters)}
+
+    def __setstate__(self, state):
+        self.counters = defaultdict(float, state["counters"])
+        self._lock = threading.Lock()
+
+    def add(self, name: str, value: float = 1, **labels: str):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] += value
+
+    def get(self, name: str, **labels: str) -> float:
+        return self.counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    @contextmanager
+    def time_stage(self, stage: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add("stage_seconds_total", time.perf_counter() - start, stage=stage)
+
+    def merge(self, other: "ExtractionMetrics"):
+        with self._lock:
+            for key, value in other.counters.items():
+                self.counters[key] += value
+
+    def to_dict(self) -> Dict[str, float]:
+        """
+        Flat `{'name{label="value"}': value}` view, e.g. for logging or JSON.
+        """
+        return {
+            _format_metric_name(name, labels): value
+            for (name, labels), value in sorted(self.counters.items())
+        }
+
+    def to_prometheus(self, prefix: str = "geo_extract") -> str:
+        """
+        Dump the counters in the Prometheus text exposition format.
+        """
+        counters_by_name = defaultdict(list)
+        for (name, labels), value in sorted(self.counters.items()):
+            counters_by_name[name].append((labels, value))
+
+        lines = []
+        for name in list(_METRICS_HELP) + sorted(set(counters_by_name) - set(_METRICS_HELP)):
+            if name not in counters_by_name:
+                continue
+            full_name = f"{prefix}_{name}"
+            if name in _METRICS_HELP:
+                lines.append(f"# HELP {full_name} {_METRICS_HELP[name]}")
+            lines.append(f"# TYPE {full_name} counter")
+            for labels, value in counters_by_name[name]:
+                lines.append(f"{_format_metric_name(full_name, labels)} {float(value)!r}")
+        return "\n".join(lines) + "\n"
+
+
+def _format_metric_name(name: str, labels: Tuple[Tuple[str, str], ...]) -> str:
+    if len(labels) == 0:
+        return name
+    formatted_labels = ",".join(f'{key}="{value}"' for key, value in labels)
+    return f"{name}{{{formatted_labels}}}"
@@ -0,0 +1,237 @@
+import os
+import json
+import hashlib
+import threading
+import time
+import torch
+import transformers
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+from transformers import AutoConfig, AutoTokenizer, GenerationConfig, AutoModelForTokenClassification, MarianTokenizer, MarianMTModel
+from transformers import pipeline
+from transformers.modeling_utils import no_init_weights
+
+
+# process-wide cache of the loaded models, shared by all the extractors
+_loaded_models: Dict[Hashable, Any] = {}
+_models_load_times: Dict[Hashable, float] = {}
+_models_locks: Dict[Hashable, threading.Lock] = {}
+_registry_lock = threading.Lock()
+
+
+def _get_or_load(key: Hashable, loader: Callable[[], Any]) -> Any:
+    """
+    Return the cached object for `key`, loading it once with `loader`.
+    Concurrent callers of the same key wait for the first load instead of loading twice.
+    """
+    with _registry_lock:
+        if key in _loaded_models:
+            return _loaded_models[key]
+        key_lock = _models_locks.setdefault(key, threading.Lock())
+
+    with key_lock:
+        if key not in _loaded_models:
+            start = time.perf_counter()
+            loaded = loader()
+            with _registry_lock:
+                _loaded_models[key] = loaded
+                _models_load_times[key] = time.perf_counter() - start
+        return _loaded_models[key]
+
+
+INFERENCE_BACKENDS = ("torch", "torch-int8", "onnx")
+
+# converted (quantized / exported) models are cached here
+_converted_models_dir = os.getenv(
+    "GEO_EXTRACT_MODELS_CACHE",
+    os.path.join(os.path.expanduser("~"), ".cache", "geo_extract"),
+)
+
+
+def _get_model_revision(model_name: str) -> Optional[str]:
+    """
+    Commit of a hub model (resolved from the local hub cache when offline), or the
+    names, sizes and modification times of the files of a local model directory.
+    """
+    if os.path.isdir(model_name):
+        return json.dumps(
+            sorted(
+                (file_name, file_stats.st_size, file_stats.st_mtime_ns)
+                for file_name in os.listdir(model_name)
+                for file_stats in [os.stat(os.path.join(model_name, file_name))]
+            )
+        )
+    return getattr(AutoConfig.from_pretrained(model_name), "_commit_hash", None)
+
+
+def _get_converted_model_path(
+    model_name: str, backend: str, libraries_versions: Dict[str, str]
+) -> str:
+    """
+    Cache directory of a converted model, specific to the model revision and to the
+    versions of the libraries that converted it: stale conversions are not reused.
+    """
+    conversion_key = hashlib.sha256(
+        json.dumps(
+            [_get_model_revision(model_name), sorted(libraries_versions.items())]
+        ).encode("utf-8")
+    ).hexdigest()[:16]
+    return os.path.join(
+        _converted_models_dir,
+        backend,
+        model_name.strip("/").replace("/", "--"),
+        conversion_key,
+    )
+
+
+def _check_backend(backend: str, device: str):
+    if backend not in INFERENCE_BACKENDS:
+        raise ValueError(
+            f"Unknown inference backend {backend}, expected one of {INFERENCE_BACKENDS}"
+        )
+    if backend != "torch" and device != "cpu":
+        raise ValueError(f"The {backend} inference backend only runs on cpu")
+
+
+def _quantize_dynamic_int8(model: torch.nn.Module) -> torch.nn.Module:
+    return torch.ao.quantization.quantize_dynamic(
+        model.eval(), {torch.nn.Linear}, dtype=torch.qint8
+    )
+
+
+def _load_int8_model(model_class: type, model_name: str) -> torch.nn.Module:
+    """
+    int8 dynamic quantization of the linear layers, cached on disk after the first run.
+
+    The quantized weights are saved as a `state_dict`. Later loads quantize an
+    uninitialized model built from the config and load them into it, without
+    reading the fp32 checkpoint.
+    """
+    quantized_model_path = os.path.join(
+        _get_converted_model_path(
+            model_name,
+            "torch-int8",
+            {"torch": torch.__version__, "transformers": transformers.__version__},
+        ),
+        "model.pt",
+    )
+    if os.path.exists(quantized_model_path):
+        config = AutoConfig.from_pretrained(model_name)
+        with no_init_weights():
+            # auto classes are built from the config, model classes by their constructor
+            model = (
+                model_class.from_config(config)
+                if hasattr(model_class, "from_config")
+                else model_class(config)
+            )
+        if model.can_generate():
+            try:
+                # decoding defaults that `from_pretrained` would have loaded
+                model.generation_config = GenerationConfig.from_pretrained(model_name)
+            except OSError:
+                pass
+        quantized_model = _quantize_dynamic_int8(model)
+        quantized_model.load_state_dict(
+            torch.load(quantized_model_path, weights_only=True)
+        )
+        return quantized_model
+
+    quantized_model = _quantize_dynamic_int8(model_class.from_pretrained(model_name))
+    os.makedirs(os.path.dirname(quantized_model_path), exist_ok=True)
+    torch.save(quantized_model.state_dict(), quantized_model_path)
+    return quantized_model
+
+
+def _load_onnx_model(model_class_name: str, model_name: str):
+    """
+    Load an ONNX Runtime model with `optimum`, exporting it once to the cache directory.
+    """
+    try:
+        import onnxruntime
+        import optimum.onnxruntime
+        from optimum.version import __version__ as optimum_version
+    except ImportError as e:
+        raise ImportError(
+            "The onnx inference backend requires `pip install optimum[onnxruntime]`"
+        ) from e
+
+    model_class = getattr(optimum.onnxruntime, model_class_name)
+    onnx_model_path = _get_converted_model_path(
+        model_name,
+        "onnx",
+        {
+            "torch": torch.__version__,
+            "transformers": transformers.__version__,
+            "optimum": optimum_version,
+            "onnxruntime": onnxruntime.__version__,
+        },
+    )
+    if os.path.exists(onnx_model_path):
+        return model_class.from_pretrained(onnx_model_path)
+
+    onnx_model = model_class.from_pretrained(model_name, export=True)
+    onnx_model.save_pretrained(onnx_model_path)
+    return onnx_model
+
+
+def get_ner_pipeline(model_name: str, device: str, backend: str = "torch"):
+    _check_backend(backend, device)
+
+    def _load_ner_pipeline():
+        tokenizer = AutoTokenizer.from_pretrained(model_name)
+        if backend == "onnx":
+            model = _load_onnx_model("ORTModelForTokenClassification", model_name)
+        elif backend == "torch-int8":
+            model = _load_int8_model(AutoModelForTokenClassification, model_name)
+        else:
+            model = AutoModelForTokenClassification.from_pretrained(model_name)
+        return pipeline(
+            "ner",
+            model=model,
+            tokenizer=tokenizer,
+            grouped_entities=True,
+            device=device,
+        )
+
+    return _get_or_load(("ner", model_name, device, backend), _load_ner_pipeline)
+
+
+def get_mt_model(
+    mt_model_name: str, device: str, backend: str = "torch"
+) -> Tuple[MarianTokenizer, MarianMTModel]:
+    _check_backend(backend, device)
+
+    def _load_mt_model():
+        mt_tokenizer = MarianTokenizer.from_pretrained(mt_model_name)
+        if backend == "onnx":
+            return mt_tokenizer, _load_onnx_model("ORTModelForSeq2SeqLM", mt_model_name)
+
+        if backend == "torch-int8":
+            mt_model = _load_int8_model(MarianMTModel, mt_model_name)
+        else:
+            mt_model = MarianMTModel.from_pretrained(mt_model_name)
+        mt_model.to(device)
+        return mt_tokenizer, mt_model
+
+    return _get_or_load(("mt", mt_model_name, device, backend), _load_mt_model)
+
+
+def get_cached(key: Hashable, loader: Callable[[], Any]) -> Any:
+    """
+    Cache any other process-wide object (e.g. whole extractors) in the registry.
+    """
+    return _get_or_load(key, loader)
+
+
+def get_models_load_times() -> Dict[Hashable, float]:
+    """
+    Seconds spent loading each cached entry (cold start). Warm calls do not add to it.
+    """
+    with _registry_lock:
+        return dict(_models_load_times)
+
+
+def clear_model_registry():
+    with _registry_lock:
+        _loaded_models.clear()
+        _models_load_times.clear()
+        _models_locks.clear()
@@ -0,0 +1,141 @@
+import os
+import pickle
+import re
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+# bump when the content of the saved index changes
+_POLYGONS_INDEX_VERSION = 1
+
+# decimal degrees pairs, e.g. "36.45, 10.73", "36.45°N 10.73°E" or "-1.2921; 36.8219"
+# (at least 2 decimals, so that "1.5, 2.3 million" is not taken for coordinates, and
+# a separator, degree sign or hemisphere between them, so that "1.25 3.40" is not)
+_COORDINATES_PATTERN = re.compile(
+    r"(?<![\w.])(?P<lat>[-+]?\d{1,2}\.\d{2,})(?:\s*°)?(?:\s*(?P<lat_hemisphere>[NS]))?"
+    r"(?:\s*[,;/]\s*|(?<=[°NS])\s*)"
+    r"(?P<lon>[-+]?\d{1,3}\.\d{2,})(?:\s*°)?(?:\s*(?P<lon_hemisphere>[EW])(?!\w))?"
+    r"(?!°?\w|\.\d)"
+)
+
+
+def _extract_coordinates(text: str) -> List[Tuple[str, float, float]]:
+    """
+    Return the (matched text, latitude, longitude) of the decimal coordinates of a text.
+    """
+    coordinates = []
+    for match in _COORDINATES_PATTERN.finditer(text):
+        lat, lon = float(match.group("lat")), float(match.group("lon"))
+        if match.group("lat_hemisphere") == "S":
+            lat = -abs(lat)
+        if match.group("lon_hemisphere") == "W":
+            lon = -abs(lon)
+        if -90 <= lat <= 90 and -180 <= lon <= 180:
+            coordinates.append((match.group(0).strip(), lat, lon))
+    return coordinates
+
+
+def _save_polygons_index(
+    geometries: Sequence,
+    countries: Sequence[str],
+    locations_hierarchies: Sequence[Dict[int, Dict[str, str]]],
+    index_path: os.PathLike,
+):
+    """
+    Save the polygons with their `{admin_level: {id, name, Pcode}}` and their STRtree,
+    so that the index is bulk-loaded once at dataprep time.
+    """
+    from shapely import STRtree
+
+    geometries = np.asarray(geometries, dtype=object)
+    polygons_index = {
+        "version": _POLYGONS_INDEX_VERSION,
+        "tree": STRtree(geometries),
+        "countries": np.asarray(countries, dtype=object),
+        "locations_hierarchies": list(locations_hierarchies),
+    }
+    with open(index_path, "wb") as f:
+        pickle.dump(polygons_index, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+class ReverseGeocoder:
+    """
+    Resolve (latitude, longitude) points to the admin-level hierarchy of the polygon
+    containing them, through the STRtree saved by `load_gpkg_polygons_data.py`.
+
+    The index is loaded on the first lookup and kept for the lifetime of the object.
+    """
+
+    def __init__(
+        self,
+        polygons_index_path: os.PathLike = os.getenv(
+            "POLYGONS_INDEX_PATH", os.path.join("data", "adm_polygons_index.pkl")
+        ),
+    ):
+        self.polygons_index_path = polygons_index_path
+        self._polygons_index: Optional[Dict] = None
+        self._lock = threading.Lock()
+
+    def _get_polygons_index(self) -> Dict:
+        with self._lock:
+            if self._polygons_index is None:
+                with open(self.polygons_index_path, "rb") as f:
+                    polygons_index = pickle.load(f)
+                if polygons_index.get("version") != _POLYGONS_INDEX_VERSION:
+                    raise ValueError(
+                        f"{self.polygons_index_path} was built by another version, "
+                        "run data/dataprep/load_gpkg_polygons_data.py again"
+                    )
+                self._polygons_index = polygons_index
+            return self._polygons_index
+
+    def get_locations_hierarchies(
+        self,
+        points: Sequence[Tuple[float, float]],
+        country_names: Optional[List[str]] = None,
+    ) -> List[Dict[int, Dict[str, str]]]:
+        """
+        Return the `{admin_level: {id, name, Pcode}}` of each (latitude, longitude)
+        point, `{}` for points outside the polygons (of `country_names` if given).
+        All the points are queried at once against the tree.
+        """
+        import shapely
+
+        if len(points) == 0:
+            return []
+        polygons_index = self._get_polygons_index()
+
+        latitudes, longitudes = np.asarray(points, dtype=float).T
+        points_ids, polygons_ids = polygons_index["tree"].query(
+            shapely.points(longitudes, latitudes), predicate="intersects"
+        )
+
+        if country_names is not None:
+            country_names = set(country_names)
+            in_countries = np.array(
+                [
+                    country_name in country_names
+                    for country_name in polygons_index["countries"][polygons_ids]
+                ],
+                dtype=bool,
+            )
+            points_ids, polygons_ids = points_ids[in_countries], polygons_ids[in_countries]
+
+        # a point on a border intersects several polygons: keep the first one
+        order = np.lexsort((polygons_ids, points_ids))
+        points_ids, polygons_ids = points_ids[order], polygons_ids[order]
+        locations_hierarchies = [{} for _ in range(len(points))]
+        matched_points = set()
+        for point_id, polygon_id in zip(points_ids.tolist(), polygons_ids.tolist()):
+            if point_id in matched_points:
+                continue
+            matched_points.add(point_id)
+            locations_hierarchies[point_id] = {
+                admin_level: dict(location)
+                for admin_level, location in polygons_index["locations_hierarchies"][
+                    polygon_id
+                ].items()
+            }
+        return locations_hierarchies
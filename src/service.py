@@ -0,0 +1,262 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from src.geolocation_extraction import (
+    GeolocationExtractor,
+    _get_outputs,
+    get_geolocation_extractor,
+)
+from src.metrics import ExtractionMetrics
+
+
+class _ServiceRequest:
+    def __init__(
+        self, text: List[str], countries: Optional[List[str]], future: asyncio.Future
+    ):
+        self.text = text
+        self.countries = countries
+        # None: matched against all the countries
+        self.country_set = tuple(sorted(set(countries))) if countries is not None else None
+        self.future = future
+
+
+def _fail_requests(requests: List[_ServiceRequest], exception: Exception):
+    for request in requests:
+        if not request.future.done():
+            request.future.set_exception(exception)
+
+
+class GeolocationService:
+    """
+    asyncio front-end of a `GeolocationExtractor` for many small concurrent requests.
+
+    Requests are queued and coalesced into shared batches of at most `max_batch_texts`
+    texts: a batch is closed when it is full or `max_wait_ms` after its first request.
+    NER and translation run once on the whole batch, matching runs once per country
+    set, and every caller gets the outputs of its own texts (same keys as `__call__`).
+    Batches run one at a time in a worker thread, so the event loop stays free and
+    the next batch fills up while the current one is processed.
+
+        async with GeolocationService() as service:
+            outputs = await service.extract(["I am in Nabeul"], ["Tunisia"])
+    """
+
+    def __init__(
+        self,
+        extractor: Optional[GeolocationExtractor] = None,
+        max_batch_texts: int = int(os.getenv("SERVICE_MAX_BATCH_TEXTS", 64)),
+        max_wait_ms: float = float(os.getenv("SERVICE_MAX_WAIT_MS", 10)),
+        max_queued_requests: int = int(os.getenv("SERVICE_MAX_QUEUED_REQUESTS", 1024)),
+    ):
+        self.extractor = extractor if extractor is not None else get_geolocation_extractor()
+        self.max_batch_texts = max_batch_texts
+        self.max_wait_ms = max_wait_ms
+        self.max_queued_requests = max_queued_requests
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._batching_task: Optional[asyncio.Task] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        # dequeued request that did not fit in the previous batch
+        self._next_request: Optional[_ServiceRequest] = None
+
+    async def __aenter__(self) -> "GeolocationService":
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.stop()
+
+    async def start(self):
+        if self._batching_task is not None:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queued_requests)
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._batching_task = asyncio.create_task(self._batching_loop())
+
+    async def stop(self):
+        if self._batching_task is None:
+            return
+        self._batching_task.cancel()
+        try:
+            await self._batching_task
+        except asyncio.CancelledError:
+            pass
+        self._batching_task = None
+
+        pending_requests = [] if self._next_request is None else [self._next_request]
+        self._next_request = None
+        while not self._queue.empty():
+            pending_requests.append(self._queue.get_nowait())
+        _fail_requests(pending_requests, RuntimeError("GeolocationService stopped"))
+
+        # waits for the running batch without blocking the event loop
+        executor, self._executor = self._executor, None
+        await asyncio.get_running_loop().run_in_executor(None, executor.shutdown, True)
+
+    async def extract(
+        self, text: List[str], countries: Optional[List[str]] = None
+    ) -> Dict[str, List[Any]]:
+        """
+        Queue the texts of one request and wait for their outputs.
+        """
+        if self._batching_task is None:
+            raise RuntimeError("GeolocationService is not started")
+        if len(text) == 0:
+            return _get_outputs([], [])
+
+        future = asyncio.get_running_loop().create_future()
+        # waits when `max_queued_requests` requests are already queued (backpressure)
+        await self._queue.put(_ServiceRequest(text, countries, future))
+        return await future
+
+    async def _get_next_batch(self, batch: List[_ServiceRequest]):
+        """
+        Fill `batch`, owned by the caller so that the requests already dequeued can be
+        failed if the service stops meanwhile. A request that would take the batch over
+        `max_batch_texts` texts is kept for the next one (a larger request is a batch
+        on its own).
+        """
+        if self._next_request is not None:
+            request, self._next_request = self._next_request, None
+        else:
+            request = await self._queue.get()
+        batch.append(request)
+        n_texts = len(request.text)
+        deadline = asyncio.get_running_loop().time() + self.max_wait_ms / 1000
+        while n_texts < self.max_batch_texts:
+            timeout = deadline - asyncio.get_running_loop().time()
+            if timeout <= 0:
+                break
+            get_task = asyncio.ensure_future(self._queue.get())
+            try:
+                done, _ = await asyncio.wait({get_task}, timeout=timeout)
+            except asyncio.CancelledError:
+                get_task.cancel()
+                if get_task.done() and not get_task.cancelled():
+                    batch.append(get_task.result())
+                raise
+            if len(done) == 0:
+                get_task.cancel()
+            try:
+                # a request got right before the cancellation is still returned
+                request = await get_task
+            except asyncio.CancelledError:
+                break
+            if n_texts + len(request.text) > self.max_batch_texts:
+                self._next_request = request
+                break
+            batch.append(request)
+            n_texts += len(request.text)
+
+    async def _batching_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = []
+            try:
+                await self._get_next_batch(batch)
+                batch_outputs = await loop.run_in_executor(
+                    self._executor, self._process_batch, batch
+                )
+            except asyncio.CancelledError:
+                _fail_requests(batch, RuntimeError("GeolocationService stopped"))
+                raise
+            except Exception as e:
+                _fail_requests(batch, e)
+                continue
+
+            for request, request_outputs in zip(batch, batch_outputs):
+                # the caller may have been cancelled while its batch was running
+                if not request.future.done():
+                    request.future.set_result(request_outputs)
+
+    def _process_batch(self, batch: List[_ServiceRequest]) -> List[Dict[str, List[Any]]]:
+        extractor = self.extractor
+        batch_metrics = ExtractionMetrics()
+        batch_metrics.add("service_batches_total")
+        batch_metrics.add("service_requests_total", len(batch))
+
+        # with a document cache, only the documents missing from it are processed
+        requests_texts = [request.text for request in batch]
+        requests_cache_lookups = None
+        if extractor.document_cache is not None:
+            requests_cache_lookups = [
+                extractor._get_cached_documents(request.text, request.countries, batch_metrics)
+                for request in batch
+            ]
+            requests_texts = [
+                list(missing_texts.values())
+                for _, _, missing_texts in requests_cache_lookups
+            ]
+
+        batch_texts = [one_text for text in requests_texts for one_text in text]
+        ner_results = (
+            extractor.extract_locations(batch_texts, metrics=batch_metrics)
+            if len(batch_texts) > 0
+            else []
+        )
+        requests_ner_results, start = [], 0
+        for text in requests_texts:
+            requests_ner_results.append(ner_results[start : start + len(text)])
+            start += len(text)
+
+        requests_by_country_set: Dict[Optional[Tuple[str, ...]], List[int]] = {}
+        for request_id, request in enumerate(batch):
+            requests_by_country_set.setdefault(request.country_set, []).append(request_id)
+
+        if extractor.do_translation:
+            # names are decided per country set, and translated in one MT pass
+            extractor._translate_location_groups(
+                [
+                    (
+                        [
+                            one_text_locations
+                            for request_id in request_ids
+                            for one_text_locations in requests_ner_results[request_id]
+                        ],
+                        batch[request_ids[0]].countries,
+                    )
+                    for request_ids in requests_by_country_set.values()
+                ],
+                metrics=batch_metrics,
+            )
+
+        requests_matched_locations: List[List[Dict[int, Dict[str, str]]]] = [[]] * len(batch)
+        for request_ids in requests_by_country_set.values():
+            group_ner_results = [
+                one_text_locations
+                for request_id in request_ids
+                for one_text_locations in requests_ner_results[request_id]
+            ]
+            if len(group_ner_results) == 0:
+                continue
+            group_matched_locations = extractor._match_locations(
+                group_ner_results, batch[request_ids[0]].countries, batch_metrics
+            )
+            start = 0
+            for request_id in request_ids:
+                end = start + len(requests_ner_results[request_id])
+                requests_matched_locations[request_id] = group_matched_locations[start:end]
+                start = end
+
+        batch_outputs = []
+        for request_id in range(len(batch)):
+            request_ner_results = requests_ner_results[request_id]
+            request_matched_locations = requests_matched_locations[request_id]
+            if requests_cache_lookups is not None:
+                request_ner_results, request_matched_locations = (
+                    extractor._get_documents_outputs(
+                        *requests_cache_lookups[request_id],
+                        request_ner_results,
+                        request_matched_locations,
+                    )
+                )
+            batch_outputs.append(
+                extractor._aggregate_outputs(
+                    request_ner_results, request_matched_locations, batch_metrics
+                )
+            )
+
+        extractor._report_metrics(batch_metrics)
+        return batch_outputs
@@ -0,0 +1,99 @@
+import queue
+import threading
+from itertools import islice
+from typing import Any, Callable, Iterable, Iterator, List
+
+
+# marks the end of the items sent through a stage queue
+_STREAM_END = object()
+
+
+class _StageError:
+    def __init__(self, exception: BaseException):
+        self.exception = exception
+
+
+def _iter_chunks(items: Iterable[Any], chunk_size: int) -> Iterator[List[Any]]:
+    items = iter(items)
+    while True:
+        chunk = list(islice(items, chunk_size))
+        if len(chunk) == 0:
+            return
+        yield chunk
+
+
+def _put_until_stopped(
+    output_queue: queue.Queue, item: Any, stop_event: threading.Event
+) -> bool:
+    while not stop_event.is_set():
+        try:
+            output_queue.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _iter_queue(input_queue: queue.Queue, stop_event: threading.Event) -> Iterator[Any]:
+    while not stop_event.is_set():
+        try:
+            item = input_queue.get(timeout=0.1)
+        except queue.Empty:
+            continue
+        if item is _STREAM_END:
+            return
+        if isinstance(item, _StageError):
+            raise item.exception
+        yield item
+
+
+def _run_stage(
+    stage: Callable[[Any], Any],
+    inputs: Iterable[Any],
+    output_queue: queue.Queue,
+    stop_event: threading.Event,
+):
+    try:
+        for item in inputs:
+            if not _put_until_stopped(output_queue, stage(item), stop_event):
+                return
+    except BaseException as e:
+        _put_until_stopped(output_queue, _StageError(e), stop_event)
+        return
+    _put_until_stopped(output_queue, _STREAM_END, stop_event)
+
+
+def _run_pipeline(
+    items: Iterable[Any],
+    stages: List[Callable[[Any], Any]],
+    max_queued_items: int = 2,
+) -> Iterator[Any]:
+    """
+    Apply the stages one after the other to every item, yielding the outputs of the
+    last stage in order. Every stage but the last one runs in its own thread, so
+    consecutive items are processed by the different stages at the same time.
+    Stages are connected by queues of at most `max_queued_items` items, which bounds
+    memory; the input iterable is only consumed as fast as the pipeline drains.
+    """
+    stop_event = threading.Event()
+    threads = []
+    inputs = iter(items)
+    for stage in stages[:-1]:
+        output_queue = queue.Queue(maxsize=max_queued_items)
+        thread = threading.Thread(
+            target=_run_stage,
+            args=(stage, inputs, output_queue, stop_event),
+            daemon=True,
+        )
+        thread.start()
+        threads.append(thread)
+        inputs = _iter_queue(output_queue, stop_event)
+
+    try:
+        for item in inputs:
+            yield stages[-1](item)
+    finally:
+        # also reached when the caller stops iterating early
+        stop_event.set()
+        for thread in threads:
+            thread.join()